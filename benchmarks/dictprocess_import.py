@@ -0,0 +1,69 @@
+"""
+Import time of a module with many functions decorated with fancy.dictprocess.act_on_dict (without explicit
+output_names, so the return names are extracted from the source), with the per-file cache of parsed return names and
+with parsing the file again for every function.
+
+Usage: python benchmarks/dictprocess_import.py [--n-functions 500]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import importlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fancy import dictprocess
+
+
+def write_module(path, n_functions):
+    with open(path, 'w') as f:
+        f.write('from fancy.dictprocess import act_on_dict\n')
+        for i in range(n_functions):
+            f.write(f'\n\n@act_on_dict\ndef step_{i}(x_{i}, *, y_{i}, scale=2):\n'
+                    f'    a_{i} = scale * x_{i}\n    b_{i} = scale * y_{i}\n    return a_{i}, b_{i}\n')
+
+
+def time_import(directory, name):
+    sys.modules.pop(name, None)
+    importlib.invalidate_caches()
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    duration = time.perf_counter() - start
+    assert module.step_0.provides == ['a_0', 'b_0']
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n-functions', type=int, default=500)
+    parser.add_argument('--repeats', type=int, default=3)
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        sys.path.insert(0, directory)
+        write_module(os.path.join(directory, 'many_steps.py'), arguments.n_functions)
+        time_import(directory, 'many_steps')  # compile to bytecode once
+
+        index = dictprocess._return_name_index
+
+        def uncached_index(file):
+            dictprocess._RETURN_NAMES.clear()
+            return index(file)
+
+        timings = {}
+        for name, index_function in [('cached', index), ('parse per function', uncached_index)]:
+            dictprocess._return_name_index = index_function
+            timings[name] = []
+            for _ in range(arguments.repeats):
+                dictprocess._RETURN_NAMES.clear()
+                timings[name].append(time_import(directory, 'many_steps'))
+        dictprocess._return_name_index = index
+
+        print(f'import of a module with {arguments.n_functions} decorated functions:')
+        for name, durations in timings.items():
+            print(f'{name:>20}: {min(durations):.3f}s')
+
+
+if __name__ == '__main__':
+    main()
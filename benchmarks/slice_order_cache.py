@@ -0,0 +1,94 @@
+"""
+Compare the block orders of fancy.slicing.slice_argsort by the cache behaviour of a blockwise pass (with halo) over
+a memmapped volume:
+ - simulated hit rate of an LRU cache of storage chunks (as used by chunked formats like zarr / n5),
+ - simulated hit rate of an LRU page cache over the flat memmap file,
+ - wall time of actually reading all blocks from the memmap (warm page cache, so mostly TLB / CPU cache effects).
+
+Usage: python benchmarks/slice_order_cache.py [--size 256] [--block 32] [--halo 8]
+"""
+import os
+import sys
+import time
+import argparse
+import itertools
+import tempfile
+from collections import OrderedDict
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fancy.slicing import block_slices, slice_argsort
+
+
+class LRU:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = self.misses = 0
+
+    def access(self, keys):
+        for key in keys:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.entries[key] = None
+                if len(self.entries) > self.capacity:
+                    self.entries.popitem(last=False)
+
+    @property
+    def hit_rate(self):
+        return self.hits / max(1, self.hits + self.misses)
+
+
+def chunks_of(tile, chunk_shape):
+    return list(itertools.product(*[range(sl.start // c, (sl.stop - 1) // c + 1)
+                                    for sl, c in zip(tile, chunk_shape)]))
+
+
+def pages_of(tile, shape, itemsize, page_size=4096):
+    # every contiguous row along the last axis touches the pages between its first and last byte
+    rows = np.meshgrid(*[np.arange(sl.start, sl.stop) for sl in tile[:-1]], [tile[-1].start], indexing='ij')
+    starts = np.ravel_multi_index(rows, shape).reshape(-1) * itemsize
+    first = starts // page_size
+    last = (starts + (tile[-1].stop - tile[-1].start) * itemsize - 1) // page_size
+    return np.unique(np.concatenate([first + i for i in range(int((last - first).max()) + 1)])).tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--block', type=int, default=32)
+    parser.add_argument('--halo', type=int, default=8)
+    parser.add_argument('--chunk', type=int, default=32, help='edge length of storage chunks')
+    parser.add_argument('--chunk-cache', type=int, default=64, help='capacity of the chunk cache, in chunks')
+    parser.add_argument('--page-cache', type=int, default=4096, help='capacity of the page cache, in 4 KiB pages')
+    arguments = parser.parse_args()
+
+    shape = (arguments.size,) * 3
+    cores, tiles, _ = block_slices(shape, (arguments.block,) * 3, arguments.halo)
+    tiles = tiles.to_slices()
+
+    with tempfile.TemporaryDirectory() as directory:
+        volume = np.memmap(os.path.join(directory, 'volume.dat'), dtype=np.float32, mode='w+', shape=shape)
+        volume[:] = np.random.rand(*shape[:1], 1, 1)
+        volume.flush()
+        print(f'volume {shape}, blocks {arguments.block}^3 with halo {arguments.halo}, {len(tiles)} blocks')
+        print(f'{"order":>8} {"chunk hits":>11} {"page hits":>10} {"read time":>10}')
+        for order in ['lex', 'diag', 'morton', 'hilbert']:
+            permutation = slice_argsort(cores, order)
+            chunk_cache, page_cache = LRU(arguments.chunk_cache), LRU(arguments.page_cache)
+            for i in permutation:
+                chunk_cache.access(chunks_of(tiles[i], (arguments.chunk,) * 3))
+                page_cache.access(pages_of(tiles[i], shape, volume.itemsize))
+            start = time.perf_counter()
+            for i in permutation:
+                np.asarray(volume[tiles[i]]).sum()
+            duration = time.perf_counter() - start
+            print(f'{order:>8} {chunk_cache.hit_rate:>11.1%} {page_cache.hit_rate:>10.1%} {duration:>9.3f}s')
+        del volume
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,27 @@
 import numpy as np
-import colorsys
+import itertools
+from functools import partial
+from multiprocessing.pool import Pool, ThreadPool
+from .memmap_utils import memmap_spec, open_array
 
 
 def hsv_to_rgb(h, s, v):
-    return np.array(colorsys.hsv_to_rgb(h, s, v), dtype=np.float32)
+    """
+    Vectorized version of colorsys.hsv_to_rgb.
+    :param h, s, v: floats or arrays of the same (or broadcastable) shape, with values between 0 and 1
+    :return: float32 array with the shape of the inputs and an additional last axis of length 3
+    """
+    h, s, v = np.broadcast_arrays(*(np.asarray(x, dtype=np.float64) for x in (h, s, v)))
+    i = np.trunc(h * 6.)
+    f = h * 6. - i
+    i = i.astype(np.int64) % 6
+    p = v * (1. - s)
+    q = v * (1. - s * f)
+    t = v * (1. - s * (1. - f))
+    rgb = np.stack([np.choose(i, [v, q, p, p, t, v]),
+                    np.choose(i, [t, v, v, q, p, p]),
+                    np.choose(i, [p, p, t, v, v, q])], axis=-1)
+    return rgb.astype(np.float32)
 
 
 def get_distinct_colors(n, min_sat=.5, min_val=.5):
@@ -11,21 +29,111 @@ def get_distinct_colors(n, min_sat=.5, min_val=.5):
     hues = np.arange(0, n) * huePartition
     saturations = np.random.rand(n) * (1-min_sat) + min_sat
     values = np.random.rand(n) * (1-min_val) + min_val
-    return np.stack([hsv_to_rgb(h, s, v) for h, s, v in zip(hues, saturations, values)], axis=0)
+    return hsv_to_rgb(hues, saturations, values).reshape(n, 3)
 
 
-def colorize_segmentation(seg, ignore_label=None, ignore_color=(0, 0, 0)):
+def _splitmix64(x):
+    """
+    Vectorized splitmix64 finalizer, a bijective hash of uint64 values.
+    """
+    with np.errstate(over='ignore'):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def label_colors(labels, seed=0, min_sat=.5, min_val=.5):
+    """
+    Colors that are a pure function of the label ids and the seed, independent of global random state and of which
+    other labels are present.
+    :param labels: integer array
+    :param seed: int
+    :return: float32 array of shape labels.shape + (3,)
+    """
+    labels = np.asarray(labels).astype(np.uint64)
+    hashed = _splitmix64(labels ^ _splitmix64(np.array(seed).astype(np.uint64)))
+    # use three independent 21 bit parts of the hash as hue, saturation and value
+    h, s, v = [((hashed >> np.uint64(shift)) & np.uint64(0x1FFFFF)) / float(0x200000) for shift in (0, 21, 42)]
+    return hsv_to_rgb(h, s * (1 - min_sat) + min_sat, v * (1 - min_val) + min_val)
+
+
+def _to_dtype(colors, dtype):
+    """
+    Convert float colors in [0, 1] to dtype, scaling them to [0, 255] for integer types.
+    """
+    colors = np.asarray(colors, dtype=np.float32)
+    if np.dtype(dtype).kind in ('u', 'i'):
+        return np.round(colors * 255).astype(dtype)
+    return colors.astype(dtype)
+
+
+def colorize_segmentation(seg, ignore_label=None, ignore_color=(0, 0, 0), dtype=np.float32, seed=None):
+    """
+    Assign random distinct colors to the labels of a segmentation.
+    The color table only has as many entries as there are distinct labels, so sparse (e.g. 64 bit) ids are fine.
+    :param seg: integer array
+    :param ignore_label: label to be colored with ignore_color
+    :param ignore_color: RGB color with values between 0 and 1
+    :param dtype: dtype of the result. If an integer type like np.uint8, colors are scaled to [0, 255]
+    :param seed: If given, the color of each label is a pure function of its id and the seed (see label_colors), such
+    that separately colorized parts of a segmentation match. Otherwise colors are drawn using np.random
+    :return: array of shape seg.shape + (3,)
+    """
     assert isinstance(seg, np.ndarray)
     assert seg.dtype.kind in ('u', 'i')
+    labels, inverse = np.unique(seg, return_inverse=True)
+    inverse = inverse.reshape(seg.shape)
+    if seed is None:
+        colors = get_distinct_colors(len(labels))
+        np.random.shuffle(colors)
+    else:
+        colors = label_colors(labels, seed)
     if ignore_label is not None:
-        ignore_ind = seg == ignore_label
-    seg = seg - np.min(seg)
-    colors = get_distinct_colors(np.max(seg) + 1)
-    np.random.shuffle(colors)
-    result = colors[seg]
-    if ignore_label is not None:
-        result[ignore_ind] = ignore_color
-    return result
+        colors[labels == ignore_label] = ignore_color
+    return _to_dtype(colors, dtype)[inverse]
+
+
+def _colorize_block(seg, out, block, **kwargs):
+    seg, out = open_array(seg, 'r'), open_array(out, 'r+')
+    out[block] = colorize_segmentation(np.asarray(seg[block]), dtype=out.dtype, **kwargs)
+
+
+def colorize_segmentation_blockwise(seg, out=None, seed=0, block_shape=None, n_jobs=0, ignore_label=None,
+                                    ignore_color=(0, 0, 0), dtype=np.float32):
+    """
+    Colorize a (possibly memory-mapped) segmentation block by block, with colors identical to
+    colorize_segmentation(seg, seed=seed) on the whole volume.
+    :param seg: integer array, e.g. np.memmap or array loaded with np.load(..., mmap_mode='r')
+    :param out: array of shape seg.shape + (3,) to write to, e.g. a np.memmap. Allocated in memory if None
+    :param seed: int, see label_colors
+    :param block_shape: shape of the blocks. Defaults to blocks of single slices along the first axis
+    :param n_jobs: number of workers. If both seg and out are file backed memmaps, processes are used, otherwise threads
+    :param ignore_label: label to be colored with ignore_color
+    :param ignore_color: RGB color with values between 0 and 1
+    :param dtype: dtype of out, if it is allocated
+    :return: out
+    """
+    assert seg.dtype.kind in ('u', 'i')
+    if out is None:
+        out = np.empty(seg.shape + (3,), dtype=dtype)
+    assert out.shape == seg.shape + (3,), f'{out.shape} != {seg.shape + (3,)}'
+    block_shape = (1,) + seg.shape[1:] if block_shape is None else block_shape
+    blocks = [tuple(slice(start, start + size) for start, size in zip(starts, block_shape))
+              for starts in itertools.product(*(range(0, s, b) for s, b in zip(seg.shape, block_shape)))]
+    seg_spec, out_spec = memmap_spec(seg), memmap_spec(out)
+    use_processes = seg_spec is not None and out_spec is not None
+    worker = partial(_colorize_block, seg_spec if use_processes else seg, out_spec if use_processes else out,
+                     seed=seed, ignore_label=ignore_label, ignore_color=ignore_color)
+    if n_jobs > 0:
+        with (Pool if use_processes else ThreadPool)(n_jobs) as p:
+            p.map(worker, blocks)
+    else:
+        for block in blocks:
+            worker(block)
+    if isinstance(out, np.memmap):  # also covers blocks written by worker processes through their own maps
+        out.flush()
+    return out
 
 
 if __name__ == '__main__':
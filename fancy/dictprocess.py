@@ -1,31 +1,104 @@
+import os
+import sys
 import ast
+import queue
+import pickle
+import hashlib
 import inspect
+import functools
+import itertools
+import threading
+from operator import itemgetter
+from collections import Counter, OrderedDict
+from collections.abc import MutableMapping
+from multiprocessing.pool import Pool, ThreadPool
+import numpy as np
+from .grid_search import ResultCache, _func_identity
+
+
+_MISSING = object()
+
+
+# per source file: (modification time, index of function names to their return names)
+_RETURN_NAMES = {}
+
+
+def _extract_return_names(function_def):
+    """
+    Return names of the first return statement in the body of a function definition, or None if there is none.
+    Failures are returned as AssertionError, to be raised only when the names of this function are requested.
+    """
+    for b in function_def.body:
+        if isinstance(b, ast.Return):
+            if isinstance(b.value, ast.Name):
+                return b.value.id,
+            elif hasattr(b.value, 'elts'):
+                if not all(hasattr(v, 'id') for v in b.value.elts):
+                    return AssertionError('cannot extract return names from nested iterable')
+                return [v.id for v in b.value.elts]
+            else:
+                return AssertionError('could not extract return names')
+
+
+def _return_name_index(file):
+    """
+    Return names of all functions defined in file, parsed only once per modification of the file. As for a search
+    with ast.walk, the first definition (with a return statement) of a name wins.
+    """
+    mtime = os.stat(file).st_mtime_ns
+    if file not in _RETURN_NAMES or _RETURN_NAMES[file][0] != mtime:
+        with open(file) as f:
+            tree = ast.parse(f.read())
+        index = {}
+        for x in ast.walk(tree):
+            if isinstance(x, ast.FunctionDef) and x.name not in index:
+                names = _extract_return_names(x)
+                if names is not None:
+                    index[x.name] = names
+        _RETURN_NAMES[file] = mtime, index
+    return _RETURN_NAMES[file][1]
 
 
 def extract_return(func, file=None):
     if file==None:
         file = inspect.getsourcefile(func)
-    fname = func.__name__
-    for x in ast.walk(ast.parse(open(file).read())):
-        if not(isinstance(x, ast.FunctionDef)):
-            continue
-        if not(x.name == fname):
-            continue
-        for b in x.body:
-            if isinstance(b, ast.Return):
-                if isinstance(b.value, ast.Name):
-                    return b.value.id,
-                elif hasattr(b.value, 'elts'):
-                    assert all(hasattr(v, 'id') for v in b.value.elts), \
-                        'cannot extract return names from nested iterable'
-                    return [v.id for v in b.value.elts]
-                else:
-                    assert False, 'could not extract return names'
+    names = _return_name_index(file).get(func.__name__)
+    if isinstance(names, AssertionError):
+        raise names
+    return list(names) if isinstance(names, list) else names
 
 
 ACTING_MODES = ['add', 'replace']
 
 
+def _tuple_getter(names):
+    # itemgetter returns a bare value instead of a tuple for a single name
+    if len(names) == 1:
+        name, = names
+        return lambda dictionary: (dictionary[name],)
+    return itemgetter(*names) if names else lambda dictionary: ()
+
+
+def _call_bound(step, names, positional, values_list):
+    func = step.__wrapped__
+    if positional:
+        return [func(*values) for values in values_list]
+    return [func(**dict(zip(names, values))) for values in values_list]
+
+
+def _map_bound(step, names, positional, values_list, n_jobs=0, use_threading=False, chunk_size=None):
+    """
+    Call the function wrapped by step on all tuples of argument values, in chunks on a pool if n_jobs > 0.
+    """
+    if n_jobs == 0:
+        return _call_bound(step, names, positional, values_list)
+    chunk_size = chunk_size or max(1, -(-len(values_list) // (4 * n_jobs)))
+    chunks = [values_list[i:i + chunk_size] for i in range(0, len(values_list), chunk_size)]
+    with (ThreadPool if use_threading else Pool)(n_jobs) as p:
+        return list(itertools.chain.from_iterable(
+            p.map(functools.partial(_call_bound, step, names, positional), chunks)))
+
+
 def act_on_dict(output_names=None, input_names=None, mode='add'):
     """
     Decorator used to make function take a single dict as input and alter that dict as output
@@ -37,6 +110,9 @@ def act_on_dict(output_names=None, input_names=None, mode='add'):
     :param mode: If 'add': Output of func is added to input dict. If 'replace': New dictionary only with outputs of func
     is returned
     :return: Dictionary containing outputs of func, and, depending on mode, everything the input contained
+
+    The decorated function also gets the methods batch (for lists of dicts) and columns (for dicts of columns), which
+    check the keys and bind the arguments only once for all records, and can distribute the records over a pool.
     """
     def wrapper(func):
         assert mode in ACTING_MODES, f'mode has to be one of {ACTING_MODES}'
@@ -87,10 +163,73 @@ def act_on_dict(output_names=None, input_names=None, mode='add'):
 
             return result
 
+        def bind(keys):
+            # check the keys once, returning the names of the values to pass and whether to pass them positionally
+            for arg in requires:
+                assert arg in keys, f"key '{arg}' whose value is required by function '{func.__name__}' is missing"
+            if input_names is not None:
+                return list(args), True
+            if varkw is not None:
+                return list(keys), False
+            names = [arg for arg in args if arg in keys]
+            keyword_names = [kwonlyarg for kwonlyarg in kwonlyargs if kwonlyarg in keys]
+            return names + keyword_names, names == args[:len(names)] and not keyword_names
+
+        def batch(dictionaries, n_jobs=0, use_threading=False, chunk_size=None):
+            """
+            Apply to a list of dicts, which all have to have the same keys.
+
+            :param n_jobs: int
+                Number of workers. If 0, all dicts are processed in the current process.
+            :param use_threading: bool
+                If true, use a thread pool instead of a process pool.
+            :param chunk_size: int, optional
+                Number of dicts sent to a worker at once.
+            :return: list of dicts, as returned for every single dict
+            """
+            dictionaries = list(dictionaries)
+            if len(dictionaries) == 0:
+                return []
+            names, positional = bind(dictionaries[0])
+            getter = _tuple_getter(names)
+            returns = _map_bound(inner, names, positional, [getter(d) for d in dictionaries],
+                                 n_jobs, use_threading, chunk_size)
+            results = dictionaries if mode == 'add' else [{} for _ in dictionaries]
+            for result, values in zip(results, returns):
+                result.update(zip(provides, values))
+            return results
+
+        def columns(columns, n_jobs=0, use_threading=False, chunk_size=None):
+            """
+            Apply to every record of a dict of equally long columns (lists or arrays), adding the outputs as lists.
+
+            :param n_jobs: int
+                Number of workers. If 0, all records are processed in the current process.
+            :param use_threading: bool
+                If true, use a thread pool instead of a process pool.
+            :param chunk_size: int, optional
+                Number of records sent to a worker at once.
+            :return: dict of columns, as returned for a single dict
+            """
+            names, positional = bind(columns)
+            lengths = {len(column) for column in columns.values()}
+            assert len(lengths) <= 1, f'columns must have the same length, got lengths {lengths}'
+            n_records = lengths.pop() if lengths else 0
+            values_list = list(zip(*(columns[name] for name in names))) if names else [()] * n_records
+            returns = _map_bound(inner, names, positional, values_list, n_jobs, use_threading, chunk_size)
+            result = columns if mode == 'add' else {}
+            for i, name in enumerate(provides):
+                result[name] = list(map(itemgetter(i), returns))
+            return result
+
         # add attributes to function specifying which keys are required, used, provided
+        functools.update_wrapper(inner, func)  # also makes module level steps picklable
         inner.requires = requires
         inner.uses = uses
         inner.provides = provides
+        inner.mode = mode
+        inner.batch = batch
+        inner.columns = columns
 
         return inner
 
@@ -113,6 +252,432 @@ def extract_from_dict(*keys):
     return extractor
 
 
+def _run_step(step, inputs):
+    outputs = step(inputs)
+    return {name: outputs[name] for name in step.provides}
+
+
+def _update_hash(h, value):
+    if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        h.update(f'ndarray{value.dtype.str}{value.shape}'.encode())
+        h.update(np.ascontiguousarray(value).reshape(-1).view(np.uint8))  # hash the buffer, without pickling
+    elif isinstance(value, (list, tuple)):
+        h.update(f'{type(value).__name__}{len(value)}'.encode())
+        for item in value:
+            _update_hash(h, item)
+    elif isinstance(value, dict):
+        h.update(f'dict{len(value)}'.encode())
+        for key, item in value.items():
+            _update_hash(h, key)
+            _update_hash(h, item)
+    elif value is None or isinstance(value, (str, bytes, bool, int, float, complex)):
+        h.update(f'{type(value).__name__}{value!r}'.encode())
+    else:
+        h.update(pickle.dumps(value, protocol=4))
+
+
+def content_hash(value):
+    """
+    Fast hash of the content of a value: arrays (also inside lists, tuples and dicts) are hashed by their buffer,
+    other objects by their pickle.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    _update_hash(h, value)
+    return h.hexdigest()
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(map(_nbytes, value))
+    if isinstance(value, dict):
+        return sum(_nbytes(key) + _nbytes(item) for key, item in value.items())
+    return sys.getsizeof(value)
+
+
+@functools.lru_cache(maxsize=None)
+def _step_identity(step):
+    return _func_identity(getattr(step, '__wrapped__', step)), tuple(step.provides)
+
+
+class StepCache:
+    """
+    In-memory cache of the outputs of act_on_dict steps, keyed by the step and the content hashes of the values it
+    uses. Least recently used entries are evicted first, and spilled to disk if a directory is given.
+    Cached outputs are returned without copying, so they must not be modified in place.
+
+    :param max_size: int, optional
+        Maximum total size in bytes of the outputs kept in memory.
+    :param max_entries: int, optional
+        Maximum number of entries kept in memory.
+    :param directory: str, optional
+        If given, entries evicted from memory are stored in a ResultCache in this directory, and loaded from there
+        when they are needed again.
+    :param max_disk_size: int, optional
+        Maximum total size in bytes of the entries on disk.
+    """
+    def __init__(self, max_size=None, max_entries=None, directory=None, max_disk_size=None):
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.disk = None if directory is None else ResultCache(directory, max_size=max_disk_size)
+        self.entries = OrderedDict()  # key: (outputs, size)
+        self.size = 0
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, step, hashes):
+        """
+        :param step: function decorated with act_on_dict
+        :param hashes: dict of content hashes of the values used by the step
+        """
+        payload = pickle.dumps((_step_identity(step), sorted(hashes.items())), protocol=4)
+        return hashlib.blake2b(payload, digest_size=20).hexdigest()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+        outputs = _MISSING if self.disk is None else self.disk.get(key, _MISSING)
+        if outputs is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.set(key, outputs)
+        return outputs
+
+    def set(self, key, outputs):
+        size = _nbytes(outputs)
+        with self._lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = outputs, size
+            self.size += size
+            evicted = []
+            while len(self.entries) > 1 and (
+                    (self.max_size is not None and self.size > self.max_size) or
+                    (self.max_entries is not None and len(self.entries) > self.max_entries)):
+                evicted_key, (evicted_outputs, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                evicted.append((evicted_key, evicted_outputs))
+        if self.disk is not None and evicted:
+            for evicted_key, evicted_outputs in evicted:
+                if evicted_key not in self.disk:
+                    self.disk.set(evicted_key, evicted_outputs)
+            self.disk.evict()
+
+    def __contains__(self, key):
+        return key in self.entries or (self.disk is not None and key in self.disk)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+        if self.disk is not None:
+            self.disk.clear()
+
+
+def memoize(step, cache):
+    """
+    Wrap a function decorated with act_on_dict such that its outputs are taken from cache (a StepCache) if it was
+    already applied to values with the same content.
+    """
+    def inner(dictionary):
+        for arg in step.requires:
+            assert arg in dictionary, \
+                f"key '{arg}' whose value is required by function '{step.__name__}' is missing"
+        inputs = {name: dictionary[name] for name in step.uses if name in dictionary}
+        key = cache.key(step, {name: content_hash(value) for name, value in inputs.items()})
+        outputs = cache.get(key, _MISSING)
+        if outputs is _MISSING:
+            outputs = _run_step(step, inputs)
+            cache.set(key, outputs)
+        result = dictionary if step.mode == 'add' else {}
+        result.update(outputs)
+        return result
+
+    functools.update_wrapper(inner, step)
+    return inner
+
+
+class Pipeline:
+    """
+    Runs functions decorated with act_on_dict as a dependency graph: a step runs as soon as all steps providing keys it
+    uses are done, independent steps run concurrently, steps whose outputs are not needed are skipped, and keys that
+    are not requested are dropped as soon as no remaining step uses them.
+
+    Every step receives a dict with only the keys it uses, and only the keys it provides are taken from its output
+    (so mode='replace' makes no difference). Each key may be provided by at most one step.
+
+    With a cache, steps whose used values did not change since they were last run are not run again. Only the given
+    input values are hashed, outputs of steps are identified by the key of the step that computed them, so that after
+    changing one input key only the steps depending on it are recomputed, without rehashing any intermediate values.
+
+    :param steps: list
+        Functions decorated with act_on_dict.
+    :param n_jobs: int
+        Number of workers. If 0, steps are run one after another in the current process.
+    :param use_threading: bool
+        If true, use a thread pool, else a process pool (steps then have to be defined at module level).
+    :param cache: StepCache, optional
+        Cache for the outputs of the steps, e.g. shared by repeated runs in an interactive session.
+    """
+    def __init__(self, steps, n_jobs=0, use_threading=True, cache=None):
+        self.steps = list(steps)
+        self.n_jobs = n_jobs
+        self.use_threading = use_threading
+        self.cache = cache
+        self.producers = {}
+        for i, step in enumerate(self.steps):
+            for name in step.provides:
+                assert name not in self.producers, f"key '{name}' is provided by more than one step"
+                self.producers[name] = i
+        # steps using a key they provide themselves get it from the input
+        self.dependencies = [{self.producers[name] for name in step.uses if name in self.producers} - {i}
+                             for i, step in enumerate(self.steps)]
+        self.dependents = [[] for _ in self.steps]
+        for i, dependencies in enumerate(self.dependencies):
+            for j in dependencies:
+                self.dependents[j].append(i)
+        assert len(self._topological_order(range(len(self.steps)))) == len(self.steps), \
+            'steps have cyclic dependencies'
+
+    def _topological_order(self, steps):
+        steps = set(steps)
+        n_waiting = {i: len(self.dependencies[i] & steps) for i in steps}
+        order = [i for i in sorted(steps) if n_waiting[i] == 0]
+        for i in order:
+            for j in self.dependents[i]:
+                if j in steps:
+                    n_waiting[j] -= 1
+                    if n_waiting[j] == 0:
+                        order.append(j)
+        return order
+
+    def needed_steps(self, outputs=None):
+        """
+        Indices of the steps needed to compute the given keys (all steps if None), in topological order.
+        """
+        if outputs is None:
+            return self._topological_order(range(len(self.steps)))
+        needed = set()
+        todo = [self.producers[name] for name in outputs if name in self.producers]
+        while todo:
+            i = todo.pop()
+            if i not in needed:
+                needed.add(i)
+                todo.extend(self.dependencies[i])
+        return self._topological_order(needed)
+
+    def __call__(self, dictionary, outputs=None):
+        """
+        :param dictionary: dict
+            Input keys and values. Not modified.
+        :param outputs: list, optional
+            Keys to compute. If None, all steps are run and all keys are kept.
+        :return:
+            dict with the requested keys (with all input and provided keys if outputs is None)
+        """
+        needed = self.needed_steps(outputs)
+        state = dict(dictionary)
+        keep = set(state) | set(self.producers) if outputs is None else set(outputs)
+        available = set(state).union(*(self.steps[i].provides for i in needed))
+        for name in outputs or ():
+            assert name in available, f"key '{name}' is neither given nor provided by any step"
+        for i in needed:
+            for name in self.steps[i].requires:
+                assert name in available, \
+                    f"key '{name}' whose value is required by step '{self.steps[i].__name__}' is missing"
+
+        consumers = Counter(name for i in needed for name in set(self.steps[i].uses))
+
+        def release(name):
+            if consumers[name] == 0 and name not in keep:
+                state.pop(name, None)
+
+        for name in list(state):
+            release(name)
+
+        needed_set = set(needed)
+        n_waiting = {i: len(self.dependencies[i] & needed_set) for i in needed}
+        ready = [i for i in needed if n_waiting[i] == 0]
+
+        def inputs(i):
+            return {name: state[name] for name in self.steps[i].uses if name in state}
+
+        hashes = {}  # content hashes of input values, keys of the computing steps for provided ones
+        keys = {}
+
+        def cached(i):
+            # look up the outputs of step i in the cache, remembering its key
+            step = self.steps[i]
+            for name in step.uses:
+                if name in state and name not in hashes:
+                    hashes[name] = content_hash(state[name])
+            keys[i] = self.cache.key(step, {name: hashes[name] for name in step.uses if name in state})
+            for name in step.provides:
+                hashes[name] = hashlib.blake2b(f'{keys[i]}{name}'.encode(), digest_size=20).hexdigest()
+            return self.cache.get(keys[i], _MISSING)
+
+        def computed(i, outputs):
+            if self.cache is not None:
+                self.cache.set(keys[i], outputs)
+            finish(i, outputs)
+
+        def finish(i, outputs):
+            state.update(outputs)
+            for name in set(self.steps[i].uses):
+                consumers[name] -= 1
+                release(name)
+            for name in outputs:
+                release(name)
+            for j in self.dependents[i]:
+                if j in n_waiting:
+                    n_waiting[j] -= 1
+                    if n_waiting[j] == 0:
+                        ready.append(j)
+
+        if self.n_jobs == 0:
+            while ready:
+                i = ready.pop(0)
+                outputs = _MISSING if self.cache is None else cached(i)
+                if outputs is _MISSING:
+                    computed(i, _run_step(self.steps[i], inputs(i)))
+                else:
+                    finish(i, outputs)
+            return state
+
+        done = queue.Queue()
+        n_running = 0
+
+        def on_result(i, result):
+            done.put((i, result, None))
+
+        def on_error(i, error):
+            done.put((i, None, error))
+
+        with (ThreadPool if self.use_threading else Pool)(self.n_jobs) as p:
+            while ready or n_running > 0:
+                while ready:
+                    i = ready.pop(0)
+                    outputs = _MISSING if self.cache is None else cached(i)
+                    if outputs is not _MISSING:
+                        finish(i, outputs)
+                        continue
+                    p.apply_async(_run_step, (self.steps[i], inputs(i)),
+                                  callback=functools.partial(on_result, i),
+                                  error_callback=functools.partial(on_error, i))
+                    n_running += 1
+                if n_running == 0:
+                    continue
+                i, result, error = done.get()
+                n_running -= 1
+                if error is not None:
+                    raise error
+                computed(i, result)
+        return state
+
+
+class LazyDict(MutableMapping):
+    """
+    Dict whose keys provided by registered act_on_dict steps are computed only when they are first read, resolving
+    the keys used by the step recursively. All outputs of a step are cached together. Setting or deleting a key
+    discards the cached values computed from it.
+
+    :param data: dict, optional
+        Initial keys and values.
+    :param steps: list, optional
+        Functions decorated with act_on_dict, see register.
+    """
+    def __init__(self, data=None, steps=()):
+        self._values = {}
+        self.producers = {}
+        self.computed = set()  # keys whose values were computed by steps
+        self._computing = set()
+        if data is not None:
+            self._values.update(data)
+        for step in steps:
+            self.register(step)
+
+    def register(self, step):
+        """
+        Compute the keys provided by step with it (replacing earlier registered steps for these keys). Values already
+        computed for these keys, and everything computed from them, are discarded.
+        """
+        for name in step.provides:
+            self.producers[name] = step
+            if name in self.computed:
+                self.computed.discard(name)
+                del self._values[name]
+                self._invalidate(name)
+        return step
+
+    def _compute(self, key):
+        assert key not in self._computing, f"key '{key}' depends on itself"
+        step = self.producers[key]
+        self._computing.add(key)
+        try:
+            inputs = {name: self[name] for name in step.uses if name in self}
+        finally:
+            self._computing.discard(key)
+        outputs = _run_step(step, inputs)
+        self._values.update(outputs)
+        self.computed.update(outputs)
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            if key not in self.producers:
+                raise KeyError(key)
+            self._compute(key)
+        return self._values[key]
+
+    def _invalidate(self, key):
+        # discard computed values of steps using key, and everything computed from them
+        for name in [name for name in self.computed if key in self.producers[name].uses]:
+            if name in self.computed:
+                self.computed.discard(name)
+                del self._values[name]
+                self._invalidate(name)
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+        self.computed.discard(key)
+        self._invalidate(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._values.pop(key, None)
+        self.producers.pop(key, None)
+        self.computed.discard(key)
+        self._invalidate(key)
+
+    def __contains__(self, key):
+        return key in self._values or key in self.producers
+
+    def __iter__(self):
+        return itertools.chain(self._values, (key for key in self.producers if key not in self._values))
+
+    def __len__(self):
+        return len(self._values) + sum(key not in self._values for key in self.producers)
+
+    def is_computed(self, key):
+        """
+        Whether the value of key was computed by a step (and not given, or not computed yet).
+        """
+        return key in self.computed
+
+    def __repr__(self):
+        items = ', '.join(f'{key!r}: {self._values[key]!r}' if key in self._values else f'{key!r}: <not computed>'
+                          for key in self)
+        return f'LazyDict({{{items}}})'
+
+
 if __name__=='__main__':
     @act_on_dict
     def foo(x, v=3, *, y, t=2):
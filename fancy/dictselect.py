@@ -1,7 +1,118 @@
 from copy import deepcopy
+from collections.abc import Mapping
+
+
+class PersistentDict(Mapping):
+    """
+    Immutable nested dict: nested dicts are converted to PersistentDicts, and changes create new PersistentDicts that
+    share all untouched subtrees (and all leaf values, e.g. arrays, which hence must not be modified in place) with
+    the original. recursive_update and recursive_choice hence only copy the dicts along the changed paths, so deriving
+    many variants from a large base config costs time and memory proportional to the changes only.
+
+    :param data: dict or iterable of key, value pairs
+    """
+    __slots__ = ('_data', '_subtree_keys')
+
+    def __init__(self, data=(), **kwargs):
+        self._data = {key: freeze(value) for key, value in dict(data, **kwargs).items()}
+        self._subtree_keys = None
+
+    @classmethod
+    def _from_frozen(cls, data):
+        # wrap a dict whose nested dicts are already frozen, without copying
+        result = cls.__new__(cls)
+        result._data = data
+        result._subtree_keys = None
+        return result
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f'PersistentDict({self._data!r})'
+
+    def __reduce__(self):
+        return PersistentDict, (self._data,)
+
+    @property
+    def subtree_keys(self):
+        """
+        Set of all keys occurring in this dict and the dicts nested in it (computed once, shared by all variants).
+        """
+        if self._subtree_keys is None:
+            self._subtree_keys = frozenset(self._data).union(
+                *(value.subtree_keys for value in self._data.values() if isinstance(value, PersistentDict)))
+        return self._subtree_keys
+
+    def set(self, key, value):
+        """
+        :return: copy of self with key set to value
+        """
+        return self.replace({key: value})
+
+    def replace(self, changes):
+        """
+        :return: copy of self with the (top level) keys and values in changes set
+        """
+        data = dict(self._data)
+        data.update((key, freeze(value)) for key, value in changes.items())
+        return PersistentDict._from_frozen(data)
+
+    def delete(self, key):
+        """
+        :return: copy of self without key
+        """
+        data = dict(self._data)
+        del data[key]
+        return PersistentDict._from_frozen(data)
+
+    def thaw(self):
+        """
+        :return: nested plain dicts with the same content (leaf values are not copied)
+        """
+        return {key: value.thaw() if isinstance(value, PersistentDict) else value for key, value in self._data.items()}
+
+
+def freeze(d):
+    """
+    Convert nested dicts to a PersistentDict. Other values, including PersistentDicts, are returned as they are.
+    """
+    return PersistentDict(d) if isinstance(d, dict) else d
+
+
+def _persistent_choice(d, key):
+    if not isinstance(d, PersistentDict):
+        return d
+    if key in d:
+        return _persistent_choice(d[key], key)
+    # only descend into subtrees containing key, all others are shared
+    changes = {k: _persistent_choice(value, key) for k, value in d.items()
+               if isinstance(value, PersistentDict) and key in value.subtree_keys}
+    return d.replace(changes) if changes else d
+
+
+def _persistent_update(d1, d2):
+    changes = {}
+    for key, value in d2.items():
+        if isinstance(d1.get(key), PersistentDict) and isinstance(value, (dict, PersistentDict)):
+            changes[key] = _persistent_update(d1[key], value)
+        else:
+            changes[key] = value
+    return d1.replace(changes)
 
 
 def recursive_choice_inplace(d, key):
+    if isinstance(d, PersistentDict):  # cannot be changed in place
+        return _persistent_choice(d, key)
     if not isinstance(d, dict):
         return d
     for k in d:
@@ -24,6 +135,8 @@ def copy_nested_dict(d: dict):
 
 
 def recursive_choice(d, key):
+    if isinstance(d, PersistentDict):
+        return _persistent_choice(d, key)
     return recursive_choice_inplace(copy_nested_dict(d), key)
 
 
@@ -35,13 +148,15 @@ def recursive_update_inplace(d1, d2):
     :return: None
     '''
     for key, value in d2.items():
-        if key in d1 and isinstance(d1[key], dict) and isinstance(value, dict):
+        if key in d1 and isinstance(d1[key], dict) and isinstance(value, (dict, PersistentDict)):
             recursive_update_inplace(d1[key], value)
         else:
             d1[key] = value
 
 
 def recursive_update(d1, d2):
+    if isinstance(d1, PersistentDict):
+        return _persistent_update(d1, d2)
     d1 = deepcopy(d1)
     recursive_update_inplace(d1, d2)
     return d1
@@ -89,3 +204,4 @@ if __name__ == '__main__':
         }
     }
     print(recursive_update(d1, d2))
+    print(recursive_update(PersistentDict(d1), d2).thaw())
@@ -1,25 +1,559 @@
 import numpy as np
 from multiprocessing.pool import ThreadPool, Pool
 import itertools
+import os
+import time
+import pickle
+import hashlib
+import tempfile
+import queue
+import numbers
+import threading
+import asyncio
+import inspect
+import contextlib
 from functools import partial
+from multiprocessing.shared_memory import SharedMemory
 from tqdm.auto import tqdm
 
 
+_MISSING = object()
+
+
+_ATTACHED_ARRAYS = {}  # shared arrays attached to in this process, by name: (array, SharedMemory or None)
+
+
+class SharedArray:
+    """
+    Read-only copy of an array placed once in shared memory (or a memory-mapped file), to be passed as argument to
+    functions evaluated with execute_parallel or grid_evaluate using a process pool. Only its name, shape and dtype are
+    transferred to the workers, where it is unpickled as a read-only numpy view, so per-task transfer costs are tiny.
+    The wrapped array is passed to the function in place of the SharedArray also when evaluating in threads or serially.
+
+    Use as a context manager, or call close() once all evaluations are done:
+
+        with SharedArray(volume) as shared_volume:
+            result = grid_evaluate(segment, [shared_volume], threshold=[0.3, 0.5, 0.7], n_jobs=8)
+
+    :param array: np.ndarray
+        Array to be shared.
+    :param backend: str
+        'shm' to use multiprocessing.shared_memory, 'memmap' to use a memory-mapped file.
+    :param directory: str, optional
+        Directory for the memory-mapped file if backend is 'memmap'. Defaults to the system temporary directory.
+    """
+    def __init__(self, array, backend='shm', directory=None):
+        assert backend in ('shm', 'memmap'), f'backend must be in ("shm", "memmap"), but got {backend}'
+        array = np.ascontiguousarray(array)
+        self.backend = backend
+        self.shape = array.shape
+        self.dtype = array.dtype
+        if backend == 'shm':
+            self._shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+            self.name = self._shm.name
+            self.array = np.ndarray(self.shape, self.dtype, buffer=self._shm.buf)
+        else:
+            fd, self.name = tempfile.mkstemp(dir=directory, suffix='.dat')
+            os.close(fd)
+            self.array = np.memmap(self.name, self.dtype, 'w+', shape=self.shape).view(np.ndarray)
+        self.array[...] = array
+        self.array.flags.writeable = False
+        self._digest = None
+        _ATTACHED_ARRAYS[self.name] = self.array, None
+
+    def __reduce__(self):
+        return _attach_shared_array, (self.backend, self.name, self.shape, self.dtype.str)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    @property
+    def digest(self):
+        """
+        Hash of the dtype, shape and content of the array, computed once on first access (the array is read-only).
+        """
+        if self._digest is None:
+            digest = hashlib.sha1(repr((self.dtype.str, self.shape)).encode())
+            digest.update(memoryview(self.array).cast('B'))
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    def close(self):
+        """
+        Release the shared memory. Views obtained from this SharedArray must not be used afterwards.
+        """
+        if self.array is None:
+            return
+        _ATTACHED_ARRAYS.pop(self.name, None)
+        self.array = None
+        if self.backend == 'shm':
+            self._shm.close()
+            self._shm.unlink()
+        else:
+            os.remove(self.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _attach_shared_array(backend, name, shape, dtype):
+    if name not in _ATTACHED_ARRAYS:
+        if backend == 'shm':
+            try:
+                shm = SharedMemory(name=name, track=False)
+            except TypeError:  # python < 3.13
+                shm = SharedMemory(name=name)
+            array = np.ndarray(shape, dtype, buffer=shm.buf)
+        else:
+            shm = None
+            array = np.memmap(name, dtype, 'r', shape=shape).view(np.ndarray)
+        array.flags.writeable = False
+        _ATTACHED_ARRAYS[name] = array, shm  # the handle keeps the mapping alive as long as the view
+    return _ATTACHED_ARRAYS[name][0]
+
+
+class _PickledArguments:
+    """
+    Arguments pickled in the calling process and unpickled only in the task itself. Errors while unpickling them in a
+    worker (e.g. failing to attach shared memory) are then raised by the task, instead of killing the worker and
+    leaving the pool waiting for the lost task forever.
+    """
+    def __init__(self, value):
+        self.payload = pickle.dumps(value, protocol=4)
+
+    def load(self):
+        return pickle.loads(self.payload)
+
+
+def _load_arguments(arg):
+    return arg.load() if isinstance(arg, _PickledArguments) else arg
+
+
+def _unwrap_shared(args, kwargs):
+    """
+    Replace SharedArrays in args and kwargs by the arrays they wrap.
+    """
+    if any(isinstance(arg, SharedArray) for arg in itertools.chain(args, kwargs.values())):
+        args = [arg.array if isinstance(arg, SharedArray) else arg for arg in args]
+        kwargs = {key: value.array if isinstance(value, SharedArray) else value for key, value in kwargs.items()}
+    return args, kwargs
+
+
+def _shared_key(value):
+    """
+    Stand-in for a SharedArray in cache keys, so that its content is hashed only once rather than once per key.
+    """
+    return ('SharedArray', value.digest) if isinstance(value, SharedArray) else value
+
+
+def _code_hash(code):
+    """
+    Hash of a code object that is stable across interpreter sessions (nested code objects, e.g. of inner functions,
+    are hashed recursively instead of using their address dependent repr). Besides the bytecode, the names of globals,
+    attributes and local variables are included, since e.g. np.sin and np.cos only differ in those.
+    """
+    h = hashlib.sha1(code.co_code)
+    h.update(repr((code.co_names, code.co_varnames)).encode())
+    for const in code.co_consts:
+        h.update(_const_repr(const).encode())
+    return h.hexdigest()
+
+
+def _const_repr(const):
+    # the repr of a frozenset (e.g. from `x in {'a', 'b'}`) depends on the hash seed, so its elements are sorted
+    if hasattr(const, 'co_code'):
+        return _code_hash(const)
+    if isinstance(const, tuple):
+        return '(' + ', '.join(_const_repr(item) for item in const) + ',)'
+    if isinstance(const, (set, frozenset)):
+        return type(const).__name__ + '({' + ', '.join(sorted(_const_repr(item) for item in const)) + '})'
+    return repr(const)
+
+
+def _cell_contents(cell):
+    try:
+        return cell.cell_contents
+    except ValueError:  # not assigned yet
+        return None
+
+
+def _value_identity(value, seen):
+    # functions in defaults and closures are identified by their code, everything else by its value. The iteration
+    # order (and thus the pickle) of sets depends on the hash seed, so their elements are sorted.
+    if isinstance(value, partial) or hasattr(value, '__code__'):
+        return _func_identity(value, seen)
+    if isinstance(value, (set, frozenset)):
+        return type(value).__name__, sorted((_value_identity(item, seen) for item in value), key=repr)
+    if type(value) in (tuple, list):
+        return type(value)(_value_identity(item, seen) for item in value)
+    if type(value) is dict:
+        return {key: _value_identity(item, seen) for key, item in value.items()}
+    return value
+
+
+def _func_identity(func, seen=()):
+    """
+    Identity of a function as used in cache keys: its qualified name together with a hash of its bytecode, its default
+    arguments and the contents of its closure, such that editing the function invalidates cached results.
+    """
+    if id(func) in seen:  # recursive closure
+        return 'recursion'
+    seen = seen + (id(func),)
+    if isinstance(func, partial):
+        args = tuple(_value_identity(arg, seen) for arg in func.args)
+        keywords = sorted((key, _value_identity(value, seen)) for key, value in func.keywords.items())
+        return _func_identity(func.func, seen), args, keywords
+    code = getattr(func, '__code__', None)
+    qualname = getattr(func, '__qualname__', type(func).__qualname__)
+    if code is None:
+        return getattr(func, '__module__', None), qualname, None
+    defaults = tuple(_value_identity(value, seen) for value in getattr(func, '__defaults__', None) or ())
+    kwdefaults = sorted((key, _value_identity(value, seen))
+                        for key, value in (getattr(func, '__kwdefaults__', None) or {}).items())
+    closure = tuple(_value_identity(_cell_contents(cell), seen) for cell in getattr(func, '__closure__', None) or ())
+    return getattr(func, '__module__', None), qualname, _code_hash(code), defaults, kwdefaults, closure
+
+
+class ResultCache:
+    """
+    On-disk cache of function results, storing one pickle file per evaluated combination of function and arguments.
+    Entries are written as soon as they are computed, such that an interrupted run can be resumed.
+
+    :param directory: str
+        Directory to store the cached results in. Created if it does not exist.
+    :param max_size: int, optional
+        Maximum total size of the cache in bytes. Least recently used entries are evicted first.
+    :param max_age: float, optional
+        Maximum time in seconds since an entry was last used before it is evicted.
+    """
+    def __init__(self, directory, max_size=None, max_age=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, func, args=(), kwargs=None):
+        # shared arrays are keyed by the digest of their content, not by the name of their shared memory
+        kwargs = {} if kwargs is None else kwargs
+        args = [_shared_key(arg) for arg in args]
+        kwargs = {key: _shared_key(value) for key, value in kwargs.items()}
+        payload = pickle.dumps((_func_identity(func), tuple(args), sorted(kwargs.items())), protocol=4)
+        return hashlib.sha1(payload).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            if self.max_age is not None and time.time() - os.path.getmtime(path) > self.max_age:
+                return default
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+        os.utime(path)  # mark as recently used
+        return value
+
+    def set(self, key, value):
+        # write to a temporary file first such that a crash never leaves a truncated entry behind
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=4)
+        os.replace(tmp_path, self._path(key))
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.pkl'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:  # removed concurrently
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        return sorted(entries)
+
+    def evict(self):
+        """
+        Remove entries older than max_age, then least recently used entries until the cache is smaller than max_size.
+        """
+        entries = self._entries()
+        now = time.time()
+        total_size = sum(size for _, size, _ in entries)
+        for mtime, size, name in entries:
+            too_old = self.max_age is not None and now - mtime > self.max_age
+            too_big = self.max_size is not None and total_size > self.max_size
+            if not (too_old or too_big):
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        for _, _, name in self._entries():
+            os.remove(os.path.join(self.directory, name))
+
+    def __len__(self):
+        return len(self._entries())
+
+
+def _skip_first_argument(func, first, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+class _CachingWorker:
+    """
+    Picklable wrapper calling func and storing the result in the cache under the key passed as first argument.
+    """
+    def __init__(self, func, cache):
+        self.func = func
+        self.cache = cache
+
+    def __call__(self, key, *args, **kwargs):
+        result = self.cache.get(key, _MISSING)
+        if result is _MISSING:
+            result = self.func(*args, **kwargs)
+            self.cache.set(key, result)
+        return result
+
+
+class ExecutionStats:
+    """
+    Collects per-task timings of execute_parallel, execute_parallel_iter or grid_evaluate when passed as stats argument.
+
+    After the run, tasks holds one record per evaluated task with fields
+        index: position of the task in the argument list
+        wall: wall time of the task in seconds
+        cpu: CPU time of the thread executing the task in seconds
+        wait: time from the start of the run until the task started
+        worker: id of the process or thread executing the task (numbered from 0)
+    and summary() reports pool utilization and the slowest tasks.
+    """
+    def __init__(self):
+        self.start_time = None
+        self.stop_time = None
+        self.n_workers = None
+        self._records = []
+
+    def _begin(self, n_jobs):
+        self.start_time = time.time()
+        self.n_workers = max(n_jobs, 1)
+
+    def _end(self):
+        self.stop_time = time.time()
+
+    def _add(self, index, timing):
+        self._records.append((index,) + timing)
+
+    def _merge(self, other, indices):
+        """
+        Add the records of other, whose task indices refer to the given subset of tasks of this run.
+        """
+        self.start_time, self.stop_time, self.n_workers = other.start_time, other.stop_time, other.n_workers
+        self._records.extend((indices[record[0]],) + record[1:] for record in other._records)
+
+    @property
+    def tasks(self):
+        tasks = np.empty(len(self._records), [('index', int), ('wall', float), ('cpu', float), ('wait', float),
+                                              ('worker', int)])
+        if len(self._records) == 0:
+            return tasks
+        index, start, stop, cpu, worker = zip(*self._records)
+        tasks['index'] = index
+        tasks['wall'] = np.subtract(stop, start)
+        tasks['cpu'] = cpu
+        tasks['wait'] = np.subtract(start, self.start_time)
+        tasks['worker'] = np.unique(worker, return_inverse=True)[1]
+        return tasks
+
+    def summary(self, n_slowest=5):
+        """
+        :param n_slowest: int
+            Number of slowest tasks to report.
+        :return:
+            dict with the total run time, the accumulated task time, the utilization of the workers (fraction of
+            time they were busy), the ratio of CPU time to wall time, the mean wait time, the busy time per worker
+            and the indices and times of the slowest tasks.
+        """
+        tasks = self.tasks
+        run_time = self.stop_time - self.start_time
+        busy_time = tasks['wall'].sum()
+        slowest = tasks[np.argsort(tasks['wall'])[::-1][:n_slowest]]
+        return dict(
+            n_tasks=len(tasks),
+            n_workers=self.n_workers,
+            run_time=run_time,
+            busy_time=busy_time,
+            utilization=busy_time / (self.n_workers * run_time) if run_time > 0 else np.nan,
+            cpu_efficiency=tasks['cpu'].sum() / busy_time if busy_time > 0 else np.nan,
+            mean_wait=tasks['wait'].mean() if len(tasks) > 0 else np.nan,
+            busy_time_per_worker=np.bincount(tasks['worker'], tasks['wall']),
+            slowest_tasks=slowest['index'],
+            slowest_times=slowest['wall'],
+        )
+
+
+class _TimedWorker:
+    """
+    Picklable wrapper returning the result of func together with (start, stop, cpu time, worker id).
+    """
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, *args, **kwargs):
+        start, cpu_start = time.time(), time.thread_time()
+        result = self.func(*args, **kwargs)
+        timing = start, time.time(), time.thread_time() - cpu_start, f'{os.getpid()}-{threading.get_ident()}'
+        return result, timing
+
+
+def _feature_key(position, value):
+    try:
+        hash(value)
+    except TypeError:  # e.g. arrays: only distinguished by type
+        value = type(value).__name__
+    return position, value
+
+
+class CostModel:
+    """
+    Estimates evaluation times of a function from completed tasks, to be passed as cost to execute_parallel. The log
+    time is modelled as sum of contributions of the individual argument values, such that e.g. the cost of an unseen
+    combination of image size and iteration count is extrapolated from tasks sharing either of them. The same model can
+    be reused across runs.
+    """
+    def __init__(self):
+        self.n_updates = 0
+        self._log_sum = 0.
+        self._features = {}  # (argument position or name, value) -> [sum of log times, count]
+
+    def _keys(self, args, kwargs):
+        return [_feature_key(i, arg) for i, arg in enumerate(args)] + \
+               [_feature_key(key, value) for key, value in kwargs.items()]
+
+    def update(self, args, kwargs, duration):
+        log_time = np.log(max(duration, 1e-9))
+        self.n_updates += 1
+        self._log_sum += log_time
+        for key in self._keys(args, kwargs):
+            stats = self._features.setdefault(key, [0., 0])
+            stats[0] += log_time
+            stats[1] += 1
+
+    def predict(self, args, kwargs):
+        if self.n_updates == 0:
+            return 1.
+        mean = self._log_sum / self.n_updates
+        log_time = mean
+        for key in self._keys(args, kwargs):
+            if key in self._features:
+                log_sum, count = self._features[key]
+                log_time += log_sum / count - mean
+        return float(np.exp(log_time))
+
+
+class _KeySkippingModel:
+    """
+    View of a CostModel ignoring the cache key that _CachingWorker takes as first argument, such that the model learns
+    the same features in cached and uncached runs.
+    """
+    def __init__(self, model):
+        self.model = model
+
+    @property
+    def n_updates(self):
+        return self.model.n_updates
+
+    def update(self, args, kwargs, duration):
+        self.model.update(args[1:], kwargs, duration)
+
+    def predict(self, args, kwargs):
+        return self.model.predict(args[1:], kwargs)
+
+
+def _scheduled_chunks(args_list, kwargs_list, estimates, model, n_jobs):
+    """
+    Chunks of tasks in order of decreasing estimated cost, each worth about a 1/(4 n_jobs) of the remaining cost (guided
+    self-scheduling), such that expensive tasks start first and the cheap ones at the end balance the load. If a
+    CostModel is given, the estimates are refreshed whenever the number of tasks it learned from has doubled.
+    """
+    pending = list(range(len(args_list)))
+    n_learned = 0
+    while pending:
+        if estimates is None or (model is not None and model.n_updates >= 2 * max(n_learned, 1)):
+            n_learned = model.n_updates
+            estimates = {i: model.predict(args_list[i], kwargs_list[i]) for i in pending}
+            pending.sort(key=estimates.get)  # cheapest first, tasks are taken from the end
+        target = sum(estimates[i] for i in pending) / (4 * n_jobs)
+        chunk, chunk_cost = [], 0
+        while pending and (not chunk or chunk_cost + estimates[pending[-1]] <= target):
+            i = pending.pop()
+            chunk.append((i, (args_list[i], kwargs_list[i])))
+            chunk_cost += estimates[i]
+        yield chunk
+
+
+def _execute_scheduled(func, args_list, kwargs_list, n_jobs, use_threading, cost, stats=None):
+    """
+    Evaluate tasks longest first according to cost (see execute_parallel), learning from the timings of completed tasks
+    if cost is a CostModel.
+    """
+    model = cost if isinstance(cost, (CostModel, _KeySkippingModel)) else None
+    estimates = None
+    if model is None:
+        costs = [cost(*args, **kwargs) for args, kwargs in zip(args_list, kwargs_list)] if callable(cost) else cost
+        assert len(costs) == len(args_list), 'need one cost estimate per task'
+        estimates = dict(enumerate(costs))
+    chunks = _scheduled_chunks(args_list, kwargs_list, estimates, model, n_jobs)
+    if estimates is not None:
+        chunks = list(chunks)
+    if not use_threading:
+        chunks = map(_PickledArguments, chunks)
+    if stats is not None:
+        stats._begin(n_jobs)
+    results = [None] * len(args_list)
+    with tqdm(total=len(args_list)) as pbar, (ThreadPool if use_threading else Pool)(n_jobs) as p:
+        for chunk_result in _imap_bounded(p, partial(chunk_worker_wrapper, _TimedWorker(func)), chunks,
+                                          max_in_flight=2 * n_jobs, ordered=False):
+            for i, (result, timing) in chunk_result:
+                results[i] = result
+                if model is not None:
+                    model.update(args_list[i], kwargs_list[i], timing[1] - timing[0])
+                if stats is not None:
+                    stats._add(i, timing)
+            pbar.update(len(chunk_result))
+    if stats is not None:
+        stats._end()
+    return results
+
+
 def worker_wrapper(worker, arg, pbar=None):
-    args, kwargs = arg
+    args, kwargs = _unwrap_shared(*_load_arguments(arg))
+    result = worker(*args, **kwargs)
     if pbar is not None:
         pbar.update(1)
-    return worker(*args, **kwargs)
+    return result
 
 
 def order_saving_worker_wrapper(worker, arg, pbar=None):
-    i, (args, kwargs) = arg
+    i, arg = arg
+    args, kwargs = _unwrap_shared(*_load_arguments(arg))
+    result = worker(*args, **kwargs)
     if pbar is not None:
         pbar.update(1)
-    return i, worker(*args, **kwargs)
+    return i, result
 
 
-def execute_parallel(func, args_list=None, kwargs_list=None, n_jobs=0, use_threading=False):
+def _normalize_arguments(args_list, kwargs_list):
     assert args_list is not None or kwargs_list is not None
     if args_list is None:
         assert kwargs_list is not None, 'either args_list or kwargs_list must not be None'
@@ -27,6 +561,83 @@ def execute_parallel(func, args_list=None, kwargs_list=None, n_jobs=0, use_threa
     if kwargs_list is None:
         assert args_list is not None, 'either args_list or kwargs_list must not be None'
         kwargs_list = [{}] * len(args_list)
+    return args_list, kwargs_list
+
+
+def execute_parallel(func, args_list=None, kwargs_list=None, n_jobs=0, use_threading=False, cache=None,
+                     stats=None, cost=None, work_queue=None):
+    """
+    Evaluate func for all given arguments, optionally in parallel.
+
+    :param func: callable
+        Function to be evaluated.
+    :param args_list: list, optional
+        List of tuples of positional arguments.
+    :param kwargs_list: list, optional
+        List of dicts of keyword arguments.
+    :param n_jobs: int
+        Number of workers. If 0, everything is evaluated in the current process.
+    :param use_threading: bool
+        If true, use a thread pool instead of a process pool.
+    :param cache: ResultCache, optional
+        Cache to load results from and store new results in.
+    :param stats: ExecutionStats, optional
+        If given, per-task timings are recorded in it.
+    :param cost: list, callable or CostModel, optional
+        Estimated cost of the tasks, given as list, as function of the arguments of func or as CostModel learning the
+        costs from completed tasks. If given, tasks are dispatched to the workers longest first, in chunks whose size
+        decreases with the remaining cost, which reduces the total run time if task costs vary a lot.
+    :param work_queue: fancy.work_queue.WorkQueue, optional
+        If given, the tasks are submitted to this queue and evaluated by all its workers (possibly on other nodes), with
+        the calling process working on them as well. n_jobs, use_threading, stats and cost are ignored then.
+    :return:
+        list of results
+
+    If func is a coroutine function, it is evaluated with execute_parallel_async in a new event loop, running at most
+    n_jobs evaluations at once (unlimited if n_jobs is 0). Only cache is supported in that case.
+    """
+    args_list, kwargs_list = _normalize_arguments(args_list, kwargs_list)
+
+    if inspect.iscoroutinefunction(func):
+        assert stats is None and cost is None and work_queue is None, \
+            'stats, cost and work_queue are not supported for coroutine functions'
+        return asyncio.run(execute_parallel_async(func, args_list, kwargs_list, max_concurrency=n_jobs, cache=cache))
+
+    if cache is not None:  # only evaluate what is not cached yet, storing new results as soon as they are computed
+        keys = [cache.key(func, args, kwargs) for args, kwargs in zip(args_list, kwargs_list)]
+        results = [cache.get(key, _MISSING) for key in keys]
+        todo = [i for i, result in enumerate(results) if result is _MISSING]
+        todo_stats = None if stats is None else ExecutionStats()
+        if cost is not None and not callable(cost) and not isinstance(cost, CostModel):
+            cost = [cost[i] for i in todo]
+        elif cost is not None and not isinstance(cost, CostModel):
+            cost = partial(_skip_first_argument, cost)  # skip cache key
+        elif cost is not None:
+            cost = _KeySkippingModel(cost)
+        computed = execute_parallel(_CachingWorker(func, cache),
+                                    [(keys[i],) + tuple(args_list[i]) for i in todo],
+                                    [kwargs_list[i] for i in todo], n_jobs, use_threading, stats=todo_stats,
+                                    cost=cost, work_queue=work_queue)
+        for i, result in zip(todo, computed):
+            results[i] = result
+        if stats is not None:
+            stats._merge(todo_stats, todo)
+        cache.evict()
+        return results
+
+    if work_queue is not None:
+        return work_queue.map(func, args_list, kwargs_list)
+
+    if cost is not None and n_jobs > 0:
+        return _execute_scheduled(func, args_list, kwargs_list, n_jobs, use_threading, cost, stats)
+
+    if stats is not None:
+        stats._begin(n_jobs)
+        timed_results = execute_parallel(_TimedWorker(func), args_list, kwargs_list, n_jobs, use_threading)
+        stats._end()
+        for i, (_, timing) in enumerate(timed_results):
+            stats._add(i, timing)
+        return [result for result, _ in timed_results]
 
     if n_jobs > 0 and use_threading:
         pbar = tqdm(total=len(args_list))
@@ -35,16 +646,298 @@ def execute_parallel(func, args_list=None, kwargs_list=None, n_jobs=0, use_threa
         pbar.close()
     elif n_jobs > 0 and not use_threading:  # use multiprocessing
         with Pool(n_jobs) as p:
-            unordered_results = list(tqdm(p.imap_unordered(partial(order_saving_worker_wrapper, func),
-                                                           enumerate(zip(args_list, kwargs_list))),
+            tasks = ((i, _PickledArguments(arg)) for i, arg in enumerate(zip(args_list, kwargs_list)))
+            unordered_results = list(tqdm(p.imap_unordered(partial(order_saving_worker_wrapper, func), tasks),
                                           total=len(args_list)))
             results = list(map(lambda x: x[1], sorted(unordered_results)))
     else:
-        results = [func(*args, **kwargs) for args, kwargs in zip(args_list, kwargs_list)]
+        results = [worker_wrapper(func, arg) for arg in zip(args_list, kwargs_list)]
     return results
 
 
-def grid_evaluate(func, *args, return_structured_array=True, **kwargs):
+async def execute_parallel_async(func, args_list=None, kwargs_list=None, max_concurrency=None, cache=None):
+    """
+    Evaluate the coroutine function func for all given arguments concurrently in the running event loop.
+
+    :param func: coroutine function
+        Function to be evaluated.
+    :param args_list: list, optional
+        List of tuples of positional arguments.
+    :param kwargs_list: list, optional
+        List of dicts of keyword arguments.
+    :param max_concurrency: int, optional
+        Maximum number of evaluations running at the same time. Unlimited if None.
+    :param cache: ResultCache, optional
+        Cache to load results from and store new results in.
+    :return:
+        list of results, in the order of the arguments
+    """
+    args_list, kwargs_list = _normalize_arguments(args_list, kwargs_list)
+    semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else contextlib.nullcontext()
+    pbar = tqdm(total=len(args_list))
+
+    async def evaluate(args, kwargs):
+        if cache is not None:
+            key = cache.key(func, args, kwargs)
+            result = cache.get(key, _MISSING)
+            if result is not _MISSING:
+                pbar.update(1)
+                return result
+        args, kwargs = _unwrap_shared(args, kwargs)
+        async with semaphore:
+            result = await func(*args, **kwargs)
+        if cache is not None:
+            cache.set(key, result)
+        pbar.update(1)
+        return result
+
+    try:
+        return await asyncio.gather(*(evaluate(args, kwargs) for args, kwargs in zip(args_list, kwargs_list)))
+    finally:
+        pbar.close()
+        if cache is not None:
+            cache.evict()
+
+
+def chunk_worker_wrapper(worker, chunk):
+    return [(i, worker_wrapper(worker, arg)) for i, arg in _load_arguments(chunk)]
+
+
+def _iter_chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _imap_bounded(pool, func, chunks, max_in_flight, ordered=True):
+    """
+    Like pool.imap (or pool.imap_unordered if ordered is False), but consumes the iterable of chunks lazily, such that at
+    most max_in_flight chunks are submitted to the pool and not yet yielded at any time.
+    """
+    done = queue.Queue()
+    buffered = {}  # chunks that finished before their predecessors, only used if ordered
+    chunks = iter(chunks)
+    exhausted = False
+    n_submitted = n_yielded = 0
+    while True:
+        while not exhausted and n_submitted - n_yielded < max_in_flight:
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                exhausted = True
+                break
+            pool.apply_async(func, (chunk,),
+                             callback=lambda result, j=n_submitted: done.put((j, result, None)),
+                             error_callback=lambda error: done.put((None, None, error)))
+            n_submitted += 1
+        if exhausted and n_yielded == n_submitted:
+            return
+        j, result, error = done.get()
+        if error is not None:
+            raise error
+        if not ordered:
+            n_yielded += 1
+            yield result
+            continue
+        buffered[j] = result
+        while n_yielded in buffered:
+            n_yielded += 1
+            yield buffered.pop(n_yielded - 1)
+
+
+def execute_parallel_iter(func, args_iter=None, kwargs_iter=None, n_jobs=0, use_threading=False, chunk_size=1,
+                          max_in_flight=None, ordered=True, cache=None, stats=None, total=None):
+    """
+    Generator version of execute_parallel. The arguments are consumed lazily and submitted to the pool in chunks, and
+    results are yielded as soon as they are available, keeping the memory for pending tasks and results bounded.
+
+    :param func: callable
+        Function to be evaluated.
+    :param args_iter: iterable, optional
+        Iterable of tuples of positional arguments. May be a generator.
+    :param kwargs_iter: iterable, optional
+        Iterable of dicts of keyword arguments. May be a generator.
+    :param n_jobs: int
+        Number of workers. If 0, everything is evaluated in the current process.
+    :param use_threading: bool
+        If true, use a thread pool instead of a process pool.
+    :param chunk_size: int
+        Number of tasks submitted to a worker at once.
+    :param max_in_flight: int, optional
+        Maximum number of chunks that are submitted but not yet yielded. Defaults to 4 * n_jobs.
+    :param ordered: bool
+        If true, results are yielded in the order of the arguments, otherwise in order of completion.
+    :param cache: ResultCache, optional
+        Cache to load results from and store new results in.
+    :param stats: ExecutionStats, optional
+        If given, per-task timings are recorded in it.
+    :param total: int, optional
+        Total number of tasks, only used for the progress bar.
+
+    :return:
+        generator of (index, result) pairs
+    """
+    assert args_iter is not None or kwargs_iter is not None, 'either args_iter or kwargs_iter must not be None'
+    assert not inspect.iscoroutinefunction(func), 'use execute_parallel_async to evaluate coroutine functions'
+    args_iter = itertools.repeat(()) if args_iter is None else args_iter
+    kwargs_iter = itertools.repeat({}) if kwargs_iter is None else kwargs_iter
+    tasks = zip(args_iter, kwargs_iter)
+    if cache is not None:
+        tasks = (((cache.key(func, args, kwargs),) + tuple(args), kwargs) for args, kwargs in tasks)
+        func = _CachingWorker(func, cache)
+    if stats is not None:
+        func = _TimedWorker(func)
+        stats._begin(n_jobs)
+    chunks = _iter_chunks(enumerate(tasks), chunk_size)
+    worker = partial(chunk_worker_wrapper, func)
+
+    def results(chunk_results):
+        for chunk_result in chunk_results:
+            pbar.update(len(chunk_result))
+            for i, result in chunk_result:
+                if stats is not None:
+                    result, timing = result
+                    stats._add(i, timing)
+                yield i, result
+
+    with tqdm(total=total) as pbar:
+        if n_jobs > 0:
+            max_in_flight = 4 * n_jobs if max_in_flight is None else max_in_flight
+            if not use_threading:
+                chunks = map(_PickledArguments, chunks)
+            with (ThreadPool if use_threading else Pool)(n_jobs) as p:
+                yield from results(_imap_bounded(p, worker, chunks, max_in_flight, ordered))
+        else:
+            yield from results(map(worker, chunks))
+    if stats is not None:
+        stats._end()
+    if cache is not None:
+        cache.evict()
+
+
+def _object_array(values, shape=None):
+    """
+    Object array containing the given values, without numpy trying to broadcast values that are sequences themselves.
+    """
+    result = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        result[i] = value
+    return result if shape is None else result.reshape(shape)
+
+
+def _typed_array(values, arrays=True, sequences=True):
+    """
+    Array of the given values with a native dtype if they are all numbers, all strings, or all numeric arrays of the
+    same shape (giving an array with additional trailing dimensions), and with object dtype otherwise.
+    Numeric arrays (if arrays) and lists or tuples of numbers (if sequences) are stacked, otherwise they are kept as
+    objects, e.g. for argument values, which should be returned as they were passed, or for tuples of results, which
+    should stay comparable.
+    """
+    if isinstance(values, np.ndarray) and values.dtype != object:
+        return values
+    values = list(values)
+    if len(values) > 0:
+        if all(isinstance(v, str) for v in values):
+            return np.array(values)
+        types = (numbers.Number, np.bool_) + ((np.ndarray,) if arrays else ()) + ((list, tuple) if sequences else ())
+        if all(isinstance(v, types) for v in values):
+            try:
+                array = np.array(values)
+            except ValueError:  # ragged
+                array = None
+            if array is not None and array.dtype.kind in 'biufc':
+                return array
+    return _object_array(values)
+
+
+def _column(values, typed, arrays=True, sequences=True):
+    return _typed_array(values, arrays, sequences) if typed else _object_array(values)
+
+
+def _fill_structured(names, columns, shape):
+    """
+    Structured array of given shape with fields given by names, whose values are broadcast from the columns. Trailing
+    dimensions of columns beyond the length of shape become the shape of the respective field.
+    """
+    dtype = np.dtype([(name, column.dtype, column.shape[len(shape):]) for name, column in zip(names, columns)])
+    array = np.empty(shape, dtype)
+    for name, column in zip(names, columns):
+        array[name] = column
+    return array
+
+
+def _structured_grid(result, args, kwargs, typed=True):
+    """
+    Wrap result grid in structured array also including the argument values of all grid points. Dimensions of result
+    beyond the number of arguments become the shape of the result field.
+    """
+    axes = args + tuple(kwargs.values())
+    names = ['result'] + [f'arg{i}' for i in range(len(args))] + list(kwargs)
+    shape = result.shape[:len(axes)]
+    columns = [result]
+    for axis, values in enumerate(axes):
+        # broadcast values along their axis of the grid
+        column = _column(values, typed, arrays=False, sequences=False)
+        columns.append(column.reshape([-1 if i == axis else 1 for i in range(len(shape))] + list(column.shape[1:])))
+    return _fill_structured(names, columns, shape)
+
+
+def _retype(points):
+    """
+    Convert object fields of a flat structured array to native dtypes where possible.
+    """
+    names = points.dtype.names
+    return _fill_structured(names, [_typed_array(points[name], arrays=name == 'result', sequences=False)
+                                    for name in names], points.shape)
+
+
+def _add_field(array, name, values):
+    names = list(array.dtype.names)
+    return _fill_structured(names + [name], [array[n] for n in names] + [values], array.shape)
+
+
+def _point_times(stats, shape, batch_size=None):
+    """
+    Wall time per grid point from the timings recorded while evaluating a grid, NaN for points without record.
+    """
+    times = np.full(int(np.prod(shape)), np.nan)
+    tasks = stats.tasks
+    if batch_size is None:
+        times[tasks['index']] = tasks['wall']
+    else:  # tasks are blocks of grid points
+        for index, wall in zip(tasks['index'], tasks['wall']):
+            block = slice(index * batch_size, (index + 1) * batch_size)
+            times[block] = wall / len(times[block])
+    return times.reshape(shape)
+
+
+def time_per_parameter(result_grid, reduction=np.mean):
+    """
+    Evaluation time per argument value, given a result grid evaluated with time_column=True.
+
+    :return:
+        dict mapping argument names to arrays of (reduced) times along the respective axis
+    """
+    return {name: marginalize(result_grid, [other for other in _axis_names(result_grid) if other != name],
+                              reduction, field='time')['time']
+            for name in _axis_names(result_grid)}
+
+
+def _evaluate_block(func, axes, n_args, keys, shape, start, stop):
+    """
+    Evaluate vectorized func on the grid points with flat indices from start to stop, passing arrays of argument values.
+    """
+    index = np.unravel_index(np.arange(start, stop), shape)
+    values = [axis[ind] for axis, ind in zip(axes, index)]
+    block = func(*values[:n_args], **dict(zip(keys, values[n_args:])))
+    assert len(block) == stop - start, f'vectorized function returned {len(block)} results for {stop - start} points'
+    return _typed_array(block)
+
+
+def grid_evaluate(func, *args, return_structured_array=True, typed=True, **kwargs):
     """
     Evaluates the function func on the cartesian product of the lists given for all the args and kwargs.
 
@@ -54,33 +947,385 @@ def grid_evaluate(func, *args, return_structured_array=True, **kwargs):
         Lists of positional argument values to be iterated over.
     :param return_structured_array: bool
         If true, result is a structured array also including all the arguments
+    :param typed: bool
+        If true, results and arguments that are all numbers, strings or numeric arrays of the same shape are stored
+        with native dtypes instead of as objects.
     :param kwargs:
         Lists of keyword argument values to be iterated over.
+        The special keywords n_jobs and cache are passed on to execute_parallel. Given a ResultCache, grid points
+        evaluated in a previous (possibly interrupted) run are loaded instead of recomputed.
+        If the special keyword chunk_size is given, grid points are generated lazily and evaluated in chunks using
+        execute_parallel_iter, filling the result array as results arrive.
+        If the special keyword batch_size is given, func has to be vectorized: It is called on blocks of up to
+        batch_size grid points, receiving arrays of argument values (one entry per grid point) and returning a sequence
+        of results of the same length. Blocks are distributed over n_jobs workers.
+        Passing an ExecutionStats as the special keyword stats records per-task timings. If the special keyword
+        time_column is true, the structured result gets an additional field 'time' holding the wall time per grid
+        point (NaN for cached points, the time per point of its block if evaluated in batches).
+        The special keyword cost is passed on to execute_parallel to schedule expensive grid points first (cost
+        estimates given as list refer to the flattened grid). It is ignored when evaluating in chunks or batches.
+        Given a fancy.work_queue.WorkQueue as the special keyword work_queue, the grid points are evaluated by the
+        workers of that queue, and the result is assembled from their completed entries.
+        Coroutine functions are evaluated concurrently in a new event loop, running at most n_jobs evaluations at once
+        (unlimited if n_jobs is 0). Of the special keywords, only n_jobs and cache are supported for them.
 
 
     :return:
         dict
     """
     n_jobs = kwargs.pop('n_jobs', 0)
+    cache = kwargs.pop('cache', None)
+    chunk_size = kwargs.pop('chunk_size', None)
+    batch_size = kwargs.pop('batch_size', None)
+    stats = kwargs.pop('stats', None)
+    time_column = kwargs.pop('time_column', False)
+    cost = kwargs.pop('cost', None)
+    work_queue = kwargs.pop('work_queue', None)
+    if inspect.iscoroutinefunction(func):
+        unsupported = dict(chunk_size=chunk_size, batch_size=batch_size, stats=stats, time_column=time_column or None,
+                           cost=cost, work_queue=work_queue)
+        unsupported = [name for name, value in unsupported.items() if value is not None]
+        assert not unsupported, f'{", ".join(unsupported)} not supported for coroutine functions'
+    stats = ExecutionStats() if time_column and stats is None else stats
     shape = tuple([len(arg) for arg in args + tuple(kwargs.values())])
 
-    args_and_kwargs = list(itertools.product(*(args + tuple(kwargs.values()))))
     n_args = len(args)
-    args_list = [a[:n_args] for a in args_and_kwargs]
-    kwargs_list = [dict(zip(kwargs.keys(), a[n_args:])) for a in args_and_kwargs]
+    args_and_kwargs = itertools.product(*(args + tuple(kwargs.values())))
+    if inspect.iscoroutinefunction(func):
+        args_list, kwargs_list = _grid_tasks(args, kwargs)
+        result = _object_array(execute_parallel(func, args_list, kwargs_list, n_jobs, cache=cache))
+    elif batch_size is not None:
+        n_points = int(np.prod(shape))
+        axes = [_typed_array(values) for values in args + tuple(kwargs.values())]
+        blocks = [(start, min(start + batch_size, n_points)) for start in range(0, n_points, batch_size)]
+        block_results = execute_parallel(partial(_evaluate_block, func, axes, n_args, list(kwargs), shape),
+                                         blocks, n_jobs=n_jobs, cache=cache, stats=stats, work_queue=work_queue)
+        result = np.concatenate(block_results) if len(block_results) > 0 else np.empty(0, dtype=object)
+    elif chunk_size is None:
+        args_list, kwargs_list = _grid_tasks(args, kwargs)
+        result = _object_array(execute_parallel(func, args_list, kwargs_list, n_jobs, cache=cache, stats=stats,
+                                                cost=cost, work_queue=work_queue))
+    else:
+        args_and_kwargs, kwargs_and_args = itertools.tee(args_and_kwargs)
+        result = np.empty(int(np.prod(shape)), dtype=object)
+        for i, value in execute_parallel_iter(func,
+                                              (a[:n_args] for a in args_and_kwargs),
+                                              (dict(zip(kwargs.keys(), a[n_args:])) for a in kwargs_and_args),
+                                              n_jobs, chunk_size=chunk_size, ordered=False, cache=cache,
+                                              stats=stats, total=len(result)):
+            result[i] = value
+    result = _assemble_grid(result, args, kwargs, typed, return_structured_array)
+    if return_structured_array and time_column:
+        result = _add_field(result, 'time', _point_times(stats, shape, batch_size))
+    return result
 
-    result = np.empty(len(args_and_kwargs), dtype=object)
-    result[...] = execute_parallel(func, args_list, kwargs_list, n_jobs)
-    result = result.reshape(shape)
+
+def _grid_tasks(args, kwargs):
+    n_args = len(args)
+    args_and_kwargs = list(itertools.product(*(args + tuple(kwargs.values()))))
+    return [a[:n_args] for a in args_and_kwargs], [dict(zip(kwargs.keys(), a[n_args:])) for a in args_and_kwargs]
+
+
+def _assemble_grid(result, args, kwargs, typed, return_structured_array):
+    """
+    Reshape flat array of results to the grid given by args and kwargs, as returned by grid_evaluate.
+    """
+    shape = tuple([len(arg) for arg in args + tuple(kwargs.values())])
+    if typed:
+        result = _typed_array(result, sequences=False)
+    elif result.dtype != object:  # from vectorized evaluation
+        result = _object_array(list(result))
+    result = result.reshape(shape + result.shape[1:])
     if return_structured_array:  # wrap args in numpy array with same shape as result
-        dtype = np.dtype([('result', object)]
-                         + [(f'arg{i}', object) for i in range(len(args))]
-                         + [(kw, object) for kw in kwargs])
-        data = [(result,) + args_kwargs for result, args_kwargs in zip(result.flatten(), args_and_kwargs)]
-        result = np.array(data, dtype).reshape(shape)
+        result = _structured_grid(result, args, kwargs, typed)
     return result
 
 
+async def grid_evaluate_async(func, *args, return_structured_array=True, typed=True, max_concurrency=None,
+                              cache=None, **kwargs):
+    """
+    Awaitable version of grid_evaluate for coroutine functions, evaluating them concurrently in the running event
+    loop. Result ordering and format are the same as for grid_evaluate.
+
+    :param func: coroutine function
+        Function to be evaluated.
+    :param args:
+        Lists of positional argument values to be iterated over.
+    :param return_structured_array: bool
+        See grid_evaluate.
+    :param typed: bool
+        See grid_evaluate.
+    :param max_concurrency: int, optional
+        Maximum number of evaluations running at the same time. Unlimited if None.
+    :param cache: ResultCache, optional
+        Cache to load results from and store new results in.
+    :param kwargs:
+        Lists of keyword argument values to be iterated over.
+    """
+    args_list, kwargs_list = _grid_tasks(args, kwargs)
+    results = await execute_parallel_async(func, args_list, kwargs_list, max_concurrency, cache)
+    return _assemble_grid(_object_array(results), args, kwargs, typed, return_structured_array)
+
+
+def _structured_points(results, args_list, kwargs_list):
+    """
+    Flat structured array of evaluated points, with the same fields as the result of grid_evaluate.
+    """
+    n_args = len(args_list[0]) if len(args_list) > 0 else 0
+    keys = list(kwargs_list[0]) if len(kwargs_list) > 0 else []
+    names = ['result'] + [f'arg{i}' for i in range(n_args)] + keys
+    columns = [_object_array(results)] \
+        + [_object_array([args[i] for args in args_list]) for i in range(n_args)] \
+        + [_object_array([kwargs[kw] for kwargs in kwargs_list]) for kw in keys]
+    return _fill_structured(names, columns, (len(results),))
+
+
+def successive_halving(func, *args, budget_name='budget', min_budget=1, max_budget=None, eta=3, n_jobs=0,
+                       cache=None, typed=True, **kwargs):
+    """
+    Adaptive alternative to grid_evaluate: All points of the cartesian product of args and kwargs are evaluated with a
+    small budget, then only the best 1/eta of them are evaluated again with eta times the budget, and so on, until a
+    single point is left or max_budget is reached. The budget (e.g. a number of iterations) is passed to func as the
+    keyword argument budget_name.
+
+    :param func: callable
+        Function to be minimized.
+    :param args:
+        Lists of positional argument values to be iterated over.
+    :param budget_name: str
+        Name of the keyword argument of func specifying the budget.
+    :param min_budget: int or float
+        Budget of the first round.
+    :param max_budget: int or float, optional
+        Maximum budget. If None, rounds continue until a single point is left.
+    :param eta: int
+        Factor by which the number of points is reduced and the budget is increased after each round.
+    :param n_jobs: int
+        Passed on to execute_parallel.
+    :param cache: ResultCache, optional
+        Passed on to execute_parallel.
+    :param typed: bool
+        See grid_evaluate.
+    :param kwargs:
+        Lists of keyword argument values to be iterated over.
+
+    :return:
+        Flat structured array of all evaluations in the format of grid_evaluate, with an additional column budget_name.
+        Evaluations are ordered by round, so the last entries were evaluated with the highest budget.
+    """
+    assert eta > 1, f'eta must be greater than 1, but got {eta}'
+    assert budget_name not in kwargs, f'{budget_name} is used for the budget and cannot be part of the grid'
+    n_args = len(args)
+    points = list(itertools.product(*(args + tuple(kwargs.values()))))
+    budget = min_budget
+    rounds = []
+    while True:
+        args_list = [p[:n_args] for p in points]
+        kwargs_list = [dict(zip(kwargs.keys(), p[n_args:]), **{budget_name: budget}) for p in points]
+        results = execute_parallel(func, args_list, kwargs_list, n_jobs, cache=cache)
+        rounds.append(_structured_points(results, args_list, kwargs_list))
+        if len(points) <= 1 or (max_budget is not None and budget >= max_budget):
+            break
+        best = np.argsort(_object_array(results), kind='stable')[:max(1, len(points) // eta)]
+        points = [points[i] for i in best]
+        budget = budget * eta if max_budget is None else min(budget * eta, max_budget)
+    points = np.concatenate(rounds)
+    return _retype(points) if typed else points
+
+
+def _is_numeric(values):
+    return all(isinstance(v, numbers.Real) and not isinstance(v, (bool, np.bool_)) for v in values)
+
+
+def _refine_axis(values, optimum):
+    """
+    Values to be evaluated next along a grid axis, given the currently optimal value: As many values as before between
+    the neighbours of the optimum (always including the optimum itself) for numeric axes, only the optimum otherwise.
+    """
+    if len(values) < 2 or not _is_numeric(values):
+        return [optimum]
+    values = sorted(values)
+    i = values.index(optimum)
+    low, high = values[max(i - 1, 0)], values[min(i + 1, len(values) - 1)]
+    refined = np.linspace(low, high, len(values))
+    if all(isinstance(v, numbers.Integral) for v in values):
+        refined = np.round(refined).astype(int)
+    return np.union1d(refined, [optimum]).tolist()
+
+
+def refine_grid(func, *args, n_refinements=3, n_jobs=0, cache=None, typed=True, **kwargs):
+    """
+    Coarse-to-fine alternative to grid_evaluate: After evaluating the grid given by args and kwargs, the grid is
+    repeatedly replaced by a finer one, spanning the neighbours of the current optimum along each numeric axis with the
+    same number of points. Non-numeric axes are fixed to their optimal value after the first round.
+
+    :param func: callable
+        Function to be minimized.
+    :param args:
+        Lists of positional argument values to be iterated over.
+    :param n_refinements: int
+        Number of refined grids evaluated after the initial one.
+    :param n_jobs: int
+        Passed on to grid_evaluate.
+    :param cache: ResultCache, optional
+        Passed on to grid_evaluate. Useful to avoid reevaluating points shared between consecutive grids.
+    :param typed: bool
+        See grid_evaluate.
+    :param kwargs:
+        Lists of keyword argument values to be iterated over.
+
+    :return:
+        Flat structured array of all evaluations in the format of grid_evaluate, ordered by refinement level.
+    """
+    axes = [list(values) for values in args + tuple(kwargs.values())]
+    n_args = len(args)
+    levels = []
+    for level in range(n_refinements + 1):
+        grid = grid_evaluate(func, *axes[:n_args], typed=False, n_jobs=n_jobs, cache=cache,
+                             **dict(zip(kwargs.keys(), axes[n_args:])))
+        levels.append(grid.ravel())
+        optimum = grid[np.unravel_index(np.argmin(grid['result']), grid.shape)]
+        refined = [_refine_axis(values, optimum[name]) for values, name in zip(axes, grid.dtype.names[1:])]
+        if refined == axes:  # converged
+            break
+        axes = refined
+    points = np.concatenate(levels)
+    return _retype(points) if typed else points
+
+
+def _scalar_field(array, field):
+    """
+    Values of the field of a structured array to rank or reduce by, which has to hold one scalar per entry.
+    """
+    shape = array.dtype[field].shape
+    assert shape == (), f"field '{field}' holds arrays of shape {shape}, which cannot be ranked. Use a scalar field, " \
+                        f"or return e.g. a tuple instead of an array to compare the results lexicographically"
+    return array[field]
+
+
 def optimal_parameters(result_grid):
-    ind = np.unravel_index(np.argmin(result_grid['result']), result_grid.shape)
-    return {name: result_grid[name][ind] for name in result_grid.dtype.names}
\ No newline at end of file
+    ind = np.unravel_index(np.argmin(_scalar_field(result_grid, 'result')), result_grid.shape)
+    return {name: result_grid[name][ind] for name in result_grid.dtype.names}
+
+
+def _axis_names(result_grid):
+    """
+    Names of the fields holding the argument values along the axes of a result grid, which follow the first field.
+    """
+    return result_grid.dtype.names[1:result_grid.ndim + 1]
+
+
+def _normalize_axes(result_grid, axes):
+    axes = [axes] if isinstance(axes, (int, str)) else list(axes)
+    names = _axis_names(result_grid)
+    axes = [names.index(axis) if isinstance(axis, str) else axis % result_grid.ndim for axis in axes]
+    return axes, [axis for axis in range(result_grid.ndim) if axis not in axes]
+
+
+def _select_fields(array, names):
+    return _fill_structured(names, [array[name] for name in names], array.shape)
+
+
+def _collapse(result_grid, axes):
+    """
+    Move the given axes to the end and flatten them into one. Fields of the remaining axes are moved to the front.
+    """
+    axes, keep = _normalize_axes(result_grid, axes)
+    names = result_grid.dtype.names
+    axis_names = _axis_names(result_grid)
+    order = [names[0]] + [axis_names[axis] for axis in keep + axes] + list(names[result_grid.ndim + 1:])
+    collapsed = _select_fields(result_grid, order).transpose(keep + axes)
+    return collapsed.reshape(collapsed.shape[:len(keep)] + (-1,)), len(keep)
+
+
+def top_k(result_grid, k, field='result', largest=False):
+    """
+    The k best entries of a result grid, sorted.
+
+    :param result_grid: np.ndarray
+        Structured array as returned by grid_evaluate.
+    :param k: int
+        Number of entries to return.
+    :param field: str
+        Field to rank by.
+    :param largest: bool
+        If true, return the largest instead of the smallest values.
+    :return:
+        Flat structured array of length k.
+    """
+    flat = result_grid.ravel()
+    values = _scalar_field(flat, field)
+    values = -values if largest else values
+    k = min(k, len(flat))
+    if k == 0:
+        return flat[:0]
+    ind = np.argpartition(values, k - 1)[:k]
+    return flat[ind[np.argsort(values[ind], kind='stable')]]
+
+
+def minimize_axes(result_grid, axes, field='result'):
+    """
+    Minimize the result grid along the given axes, keeping the full entries (including the optimal values of the
+    eliminated arguments) at the minima.
+
+    :param result_grid: np.ndarray
+        Structured array as returned by grid_evaluate.
+    :param axes: int, str or list
+        Axes to minimize over, given by index or argument name (e.g. 'arg0' or the name of a keyword argument).
+    :param field: str
+        Field to minimize.
+    :return:
+        Structured array over the remaining axes.
+    """
+    collapsed, _ = _collapse(result_grid, axes)
+    ind = np.argmin(_scalar_field(collapsed, field), axis=-1)
+    return np.take_along_axis(collapsed, ind[..., None], axis=-1)[..., 0]
+
+
+def marginalize(result_grid, axes, reduction=np.mean, field='result'):
+    """
+    Reduce the given field of the result grid along the given axes.
+
+    :param result_grid: np.ndarray
+        Structured array as returned by grid_evaluate.
+    :param axes: int, str or list
+        Axes to reduce over, given by index or argument name.
+    :param reduction: callable
+        Reduction accepting an axis keyword, such as np.mean, np.median or np.max.
+    :param field: str
+        Field to reduce.
+    :return:
+        Structured array over the remaining axes, with the reduced field followed by the remaining arguments.
+    """
+    collapsed, n_keep = _collapse(result_grid, axes)
+    names = [field] + list(collapsed.dtype.names[1:n_keep + 1])
+    columns = [np.asarray(reduction(_scalar_field(collapsed, field), axis=-1))] + [collapsed[name][..., 0] for name in names[1:]]
+    return _fill_structured(names, columns, collapsed.shape[:-1])
+
+
+def axis_profile(result_grid, axis, field='result', reduction=None):
+    """
+    Values of field along one axis, reduced over all others (minimized if reduction is None).
+
+    :return:
+        np.ndarray of length result_grid.shape[axis]
+    """
+    axes, keep = _normalize_axes(result_grid, axis)
+    if reduction is None:
+        return minimize_axes(result_grid, keep, field)[field]
+    return marginalize(result_grid, keep, reduction, field)[field]
+
+
+def sensitivity(result_grid, field='result', reduction=None):
+    """
+    Sensitivity of the result to each argument, measured as the range (max - min) of its axis profile, i.e. of the
+    best result attainable for each value of the argument (if reduction is None).
+
+    :return:
+        dict mapping argument names to sensitivities
+    """
+    sensitivities = {}
+    for axis, name in enumerate(_axis_names(result_grid)):
+        profile = axis_profile(result_grid, axis, field, reduction)
+        sensitivities[name] = np.max(profile) - np.min(profile)
+    return sensitivities
@@ -1,38 +1,225 @@
 import numpy as np
 import torch
+from multiprocessing.pool import ThreadPool
 
 
-def clip_extreme(imgs, percentile=5, allowed_steepness=3, dim=2):
+def _histogram_quantiles(flat, qs, n_bins):
+    """
+    Approximate quantiles along the last axis from histograms with n_bins bins between the minimum and maximum of each
+    row. The error is at most (max - min) / n_bins.
+    """
+    rows = flat.reshape(-1, flat.shape[-1])
+    n = rows.shape[1]
+    lo, hi = rows.min(axis=1).astype(np.float64), rows.max(axis=1).astype(np.float64)
+    width = (hi - lo) / n_bins
+    width[width == 0] = 1
+    ind = ((rows - lo[:, None]) / width[:, None]).astype(np.intp)
+    np.minimum(ind, n_bins - 1, out=ind)
+    ind += (np.arange(len(rows)) * n_bins)[:, None]
+    counts = np.bincount(ind.ravel(), minlength=len(rows) * n_bins).reshape(len(rows), n_bins)
+    cumulative = np.cumsum(counts, axis=1)
+    row_ind = np.arange(len(rows))
+    result = []
+    for q in qs:
+        rank = q * (n - 1)  # position in the sorted row, as for linear interpolation
+        b = np.minimum(np.argmax(cumulative > rank, axis=1), n_bins - 1)
+        below = cumulative[row_ind, b] - counts[row_ind, b]
+        fraction = np.clip((rank - below + .5) / np.maximum(counts[row_ind, b], 1), 0, 1)
+        result.append(lo + (b + fraction) * width)
+    return np.stack(result).reshape((len(qs),) + flat.shape[:-1])
+
+
+def _histogram_quantiles_torch(flat, qs, n_bins):
+    """
+    Torch version of _histogram_quantiles, computed on the device of the tensor.
+    """
+    rows = flat.reshape(-1, flat.shape[-1])
+    n = rows.shape[1]
+    lo, hi = rows.amin(dim=1).double(), rows.amax(dim=1).double()
+    width = (hi - lo) / n_bins
+    width[width == 0] = 1
+    ind = ((rows - lo[:, None]) / width[:, None]).long().clamp_(max=n_bins - 1)
+    ind += (torch.arange(len(rows), device=rows.device) * n_bins)[:, None]
+    counts = torch.bincount(ind.flatten(), minlength=len(rows) * n_bins).reshape(len(rows), n_bins)
+    cumulative = torch.cumsum(counts, dim=1)
+    row_ind = torch.arange(len(rows), device=rows.device)
+    result = []
+    for q in qs:
+        rank = torch.full((len(rows), 1), q * (n - 1), dtype=torch.float64, device=rows.device)
+        b = torch.searchsorted(cumulative, rank, right=True)[:, 0].clamp_(max=n_bins - 1)  # first bin beyond rank
+        below = cumulative[row_ind, b] - counts[row_ind, b]
+        fraction = ((rank[:, 0] - below + .5) / counts[row_ind, b].clamp(min=1)).clamp(0, 1)
+        result.append(lo + (b + fraction) * width)
+    return torch.stack(result).reshape((len(qs),) + tuple(flat.shape[:-1]))
+
+
+def _kth_quantiles_torch(flat, qs):
+    """
+    Quantiles with linear interpolation (as np.percentile) via torch.kthvalue, which, unlike torch.quantile, works for
+    arbitrarily large inputs.
+    """
+    n = flat.shape[-1]
+    result = []
+    for q in qs:
+        position = q * (n - 1)
+        lower = int(np.floor(position))
+        value = flat.kthvalue(lower + 1, dim=-1).values
+        if position > lower:
+            upper_value = flat.kthvalue(lower + 2, dim=-1).values
+            value = value + (upper_value - value) * (position - lower)
+        result.append(value)
+    return torch.stack(result)
+
+
+def _quantiles(flat, qs, method='exact', n_bins=4096):
+    """
+    Quantiles qs (between 0 and 1) along the last axis of a numpy array or torch tensor, all computed in one pass.
+    """
+    assert method in ('exact', 'histogram'), f'method must be in ("exact", "histogram"), but got {method}'
+    if isinstance(flat, torch.Tensor):
+        if method == 'histogram':
+            return _histogram_quantiles_torch(flat.detach(), qs, n_bins)
+        flat = flat.detach()
+        if flat.dtype not in (torch.float32, torch.float64):  # e.g. float16, bfloat16 and integers
+            flat = flat.float() if flat.is_floating_point() else flat.double()
+        if flat.numel() <= 2 ** 24:  # size limit of torch.quantile
+            return torch.quantile(flat, torch.tensor(qs, dtype=flat.dtype, device=flat.device), dim=-1)
+        return _kth_quantiles_torch(flat, qs)
+    if method == 'histogram':
+        return _histogram_quantiles(flat, qs, n_bins)
+    return np.percentile(flat, [100 * q for q in qs], axis=-1)
+
+
+def clip_extreme(imgs, percentile=5, allowed_steepness=3, dim=2, method='exact', n_bins=4096):
     """
     normalization robust to outliers
-    :param imgs: input images with arbitrary shape; last dim dimensions are assumed to be image dimensions
+    :param imgs: input images with arbitrary shape; last dim dimensions are assumed to be image dimensions.
+    Torch tensors are processed on their device.
     :param percentile:
     :param dim: data dimensionality (probably 1, 2 or 3)
+    :param method: 'exact' to compute both percentiles in a single selection pass, 'histogram' to approximate them
+    from a histogram with n_bins bins per image, with an error of at most (max - min) / n_bins
+    :param n_bins: number of histogram bins if method is 'histogram'
     :return: normalized data
     """
-    if isinstance(imgs, torch.Tensor):
-        return_torch = True
-        device = imgs.device
-        dtype = imgs.dtype
-        imgs = imgs.cpu().numpy()
-    else:
-        return_torch=False
     img_shape = imgs.shape[-dim:]
-    imgs = imgs.reshape(imgs.shape[:-dim] + (-1,))
-    # mins = np.min(imgs, axis=-1)
-    # maxs = np.max(imgs, axis=-1)
-    soft_mins = np.percentile(imgs, percentile, axis=-1)
-    soft_maxs = np.percentile(imgs, 100-percentile, axis=-1)
+    flat = imgs.reshape(imgs.shape[:-dim] + (-1,))
+    soft_mins, soft_maxs = _quantiles(flat, [percentile / 100, 1 - percentile / 100], method, n_bins)
     ranges = soft_maxs - soft_mins
-    print(ranges)
     allowed_extra = ranges * percentile/100 * allowed_steepness
-    imgs = imgs.clip((soft_mins - allowed_extra)[..., None],
-                     (soft_maxs - allowed_extra)[..., None])
-    imgs = imgs.reshape(imgs.shape[:-1] + img_shape)
-    if return_torch:
-        return torch.tensor(imgs, dtype=dtype).to(device)
+    lower, upper = (soft_mins - allowed_extra)[..., None], (soft_maxs - allowed_extra)[..., None]
+    if isinstance(imgs, torch.Tensor):
+        dtype = imgs.dtype
+        clipped = torch.minimum(torch.maximum(flat.to(lower.dtype), lower), upper).to(dtype)
+    else:
+        if flat.dtype.kind == 'f':
+            lower, upper = lower.astype(flat.dtype), upper.astype(flat.dtype)
+        clipped = flat.clip(lower, upper)
+    return clipped.reshape(clipped.shape[:-1] + img_shape)
+
+
+class QuantileSketch:
+    """
+    Mergeable summary of a stream of values for approximate quantiles. Every added block is summarized by k of its order
+    statistics, each standing for 1/k of the block, so the rank error of quantiles is at most 1/k of the number of
+    values. Sketches of different blocks (e.g. computed in parallel) can be merged. If more than max_points summary
+    points accumulate, they are compressed to k points again, adding another rank error of at most 1/k.
+    """
+    def __init__(self, k=1000, max_points=None):
+        self.k = k
+        self.max_points = 50 * k if max_points is None else max_points
+        self.values = np.empty(0)
+        self.weights = np.empty(0)
+
+    @property
+    def n(self):
+        return self.weights.sum()
+
+    def add(self, block):
+        values = np.sort(np.asarray(block), axis=None)
+        if len(values) > self.k:
+            positions = ((np.arange(self.k) + .5) * len(values) / self.k).astype(np.intp)
+            values, weights = values[positions], np.full(self.k, len(values) / self.k)
+        else:
+            weights = np.ones(len(values))
+        self._extend(values, weights)
+        return self
+
+    def merge(self, other):
+        self._extend(other.values, other.weights)
+        return self
+
+    def _extend(self, values, weights):
+        self.values = np.concatenate([self.values, values])
+        self.weights = np.concatenate([self.weights, weights])
+        if len(self.values) > self.max_points:
+            positions = (np.arange(self.k) + .5) / self.k
+            self.values, self.weights = self.quantile(positions), np.full(self.k, self.n / self.k)
+
+    def quantile(self, q):
+        order = np.argsort(self.values, kind='stable')
+        values, weights = self.values[order], self.weights[order]
+        centers = (np.cumsum(weights) - weights / 2) / weights.sum()  # quantile level of each summary point
+        return np.interp(q, centers, values)
+
+
+def _blocks(volume, block_size):
+    return [slice(start, start + block_size) for start in range(0, volume.shape[0], block_size)]
+
+
+def clip_extreme_streaming(volume, out=None, percentile=5, allowed_steepness=3, block_size=None, n_jobs=0, k=1000):
+    """
+    Out-of-core version of clip_extreme for a single volume too large for memory, treating the whole volume as one
+    image: The soft minimum and maximum are estimated in one pass with a QuantileSketch, then the volume is clipped
+    block by block.
+    :param volume: array (e.g. np.memmap) processed in blocks along its first axis, or a collection of blocks that can
+    be iterated over twice (e.g. a list of memmaps)
+    :param out: array of the same shape as volume to write to (e.g. an np.memmap), only used if volume is an array.
+    Allocated in memory if None
+    :param percentile:
+    :param block_size: number of slices along the first axis per block. Defaults to about 2**24 elements per block
+    :param n_jobs: number of threads used to sketch and clip the blocks
+    :param k: size of the quantile sketch per block; the rank error of the estimated percentiles is at most 1/k
+    :return: out, or a generator of clipped blocks if volume is a collection of blocks
+    """
+    is_array = hasattr(volume, 'shape')
+    if is_array:
+        block_size = max(1, 2 ** 24 // max(1, int(np.prod(volume.shape[1:])))) if block_size is None else block_size
+        blocks = _blocks(volume, block_size)
+        get_block = volume.__getitem__
+    else:
+        assert iter(volume) is not volume, 'volume has to be an array or a collection of blocks, not an iterator'
+        blocks = volume
+        get_block = np.asarray
+
+    def sketch(block):
+        return QuantileSketch(k).add(get_block(block))
+
+    with ThreadPool(max(n_jobs, 1)) as p:
+        sketches = p.imap(sketch, blocks) if n_jobs > 0 else map(sketch, blocks)
+        total = QuantileSketch(k)
+        for block_sketch in sketches:
+            total.merge(block_sketch)
+    soft_min, soft_max = total.quantile([percentile / 100, 1 - percentile / 100])
+    allowed_extra = (soft_max - soft_min) * percentile/100 * allowed_steepness
+    lower, upper = soft_min - allowed_extra, soft_max - allowed_extra
+
+    if not is_array:
+        return (np.asarray(block).clip(lower, upper) for block in volume)
+
+    if out is None:
+        out = np.empty(volume.shape, dtype=np.result_type(volume.dtype, np.float32))
+
+    def clip(block):
+        np.clip(volume[block], lower, upper, out=out[block], casting='unsafe')
+
+    if n_jobs > 0:
+        with ThreadPool(n_jobs) as p:
+            p.map(clip, blocks)
     else:
-        return imgs
+        for block in blocks:
+            clip(block)
+    return out
 
 
 if __name__ == '__main__':
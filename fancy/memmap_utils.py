@@ -0,0 +1,43 @@
+import os
+import mmap
+import tempfile
+import contextlib
+import numpy as np
+
+
+def memmap_spec(array):
+    """
+    Description of a file backed, C-contiguous np.memmap from which it can be reopened in another process (without
+    pickling its data), None for other arrays.
+    """
+    if isinstance(array, np.memmap) and isinstance(array.base, mmap.mmap) and array.flags.c_contiguous:
+        return array.filename, array.dtype, array.shape, array.offset
+    return None
+
+
+def open_array(array_or_spec, mode='r'):
+    """
+    Reopen a memmap described by memmap_spec, or return the given array unchanged.
+    """
+    if isinstance(array_or_spec, tuple):
+        filename, dtype, shape, offset = array_or_spec
+        return np.memmap(filename, dtype, mode, offset=offset, shape=shape)
+    return array_or_spec
+
+
+@contextlib.contextmanager
+def temporary_memmap(array, directory=None):
+    """
+    Copy array once to a memmap in a temporary file (removed on exit), such that worker processes can open it by
+    filename instead of receiving copies of the data.
+    """
+    fd, filename = tempfile.mkstemp(dir=directory, suffix='.dat')
+    os.close(fd)
+    try:
+        copy = np.memmap(filename, array.dtype, 'w+', shape=array.shape)
+        copy[...] = array
+        copy.flush()
+        yield copy
+        del copy
+    finally:
+        os.remove(filename)
@@ -1,5 +1,16 @@
 import numpy as np
-from collections import Iterable
+import math
+import itertools
+from operator import attrgetter
+from collections import deque
+from collections.abc import Iterable
+from functools import partial
+from multiprocessing.pool import Pool, ThreadPool
+import contextlib
+from .memmap_utils import memmap_spec, open_array, temporary_memmap
+
+
+_slice_attributes = attrgetter('start', 'stop', 'step')
 
 
 def _normalize_slice(sl, size=None):
@@ -22,18 +33,74 @@ def shrink_slice(sl, margin):
     if isinstance(sl, Iterable):
         return tuple(shrink_slice(s, margin) for s in sl)
     sl = _normalize_slice(sl)
-    assert margin % sl.step == 0
-    return slice(sl.start + margin, sl.stop - margin, sl.step)
+    assert sl.step > 0
+    # drop all elements closer than margin to the borders; the first kept one is the next element on the grid
+    return slice(sl.start - (-margin // sl.step) * sl.step, sl.stop - margin, sl.step)
 
 
 def _is_positive(sl):
     return sl.start >= 0 and sl.stop >= 0
 
 
+def _step_or_none(step):
+    return None if step == 1 else step
+
+
+def _modular_inverse_gcd(a, b):
+    """
+    Vectorized extended Euclidean algorithm.
+
+    :return:
+        (g, x) with g = gcd(a, b) and a * x = g (mod b)
+    """
+    old_r, r = np.array(a, dtype=np.int64), np.array(b, dtype=np.int64)
+    old_x, x = np.ones_like(old_r), np.zeros_like(old_r)
+    while (r != 0).any():
+        active = r != 0
+        q = np.where(active, old_r // np.where(active, r, 1), 0)
+        old_r, r = np.where(active, r, old_r), np.where(active, old_r - q * r, 0)
+        old_x, x = np.where(active, x, old_x), np.where(active, old_x - q * x, 0)
+    return old_r, old_x
+
+
+def _align(start0, step0, start1, step1):
+    """
+    Common elements of two infinite arithmetic progressions (vectorized generalized chinese remainder theorem).
+
+    :return:
+        (start, step, solvable), the common elements are start + k * step if solvable, with step = lcm(step0, step1)
+    """
+    start0, step0, start1, step1 = np.broadcast_arrays(*(np.asarray(x, dtype=np.int64)
+                                                         for x in (start0, step0, start1, step1)))
+    g, inverse = _modular_inverse_gcd(step0, step1)
+    solvable = (start1 - start0) % g == 0
+    step = step0 // g * step1
+    start = start0 + step0 * (((start1 - start0) // g * inverse) % (step1 // g))
+    return start % step, step, solvable
+
+
+def _strided_intersection(starts, stops, steps):
+    """
+    Intersection of K strided slices, given as arrays of shape (K, ...).
+
+    :return:
+        (start, stop, step) of the intersection, start is the first common element (or >= stop if there is none)
+    """
+    lower, stop = starts.max(axis=0), stops.min(axis=0)
+    residue, step, solvable = starts[0], steps[0], np.ones(lower.shape, dtype=bool)
+    for other_start, other_step in zip(starts[1:], steps[1:]):
+        residue, step, aligned = _align(residue, step, other_start, other_step)
+        solvable &= aligned
+    start = lower + (residue - lower) % step
+    return np.where(solvable, start, np.maximum(start, stop)), stop, step
+
+
 def slice_overlap(*slices, size=None):
     """
     Calculates the overlap between two slices (or tuples of slices for higher dimensions) in the global and local
-    reference frames
+    reference frames. For strided slices, the global overlap has the lcm of the steps as step, and the local ones
+    select the common elements from the arrays sliced by the respective input slices, i.e.
+    array[sl][local] == array[global] for every input slice sl.
 
     :param sl0: slice or tuple
     :param sl1: slice or tuple
@@ -48,17 +115,21 @@ def slice_overlap(*slices, size=None):
 
     slices = [_normalize_slice(sl, size) for sl in slices]
     assert all(_is_positive(sl) for sl in slices)
-    if not all(sl.step in (1, None) for sl in slices):
-        raise NotImplementedError
-    global_intersection = slice(max(sl.start for sl in slices), min(sl.stop for sl in slices))
-    relative_intersections = [slice(global_intersection.start - sl.start, global_intersection.stop - sl.start)
+    assert all(sl.step > 0 for sl in slices), 'only positive steps are supported'
+    start, stop, step = map(int, _strided_intersection(*np.array([_slice_attributes(sl) for sl in slices]).T))
+    global_intersection = slice(start, stop, _step_or_none(step))
+    # local stops are clipped to the local starts, so that empty overlaps do not turn into negative indices
+    relative_intersections = [slice(-(-(start - sl.start) // sl.step),
+                                    max(-(-(start - sl.start) // sl.step), -(-(stop - sl.start) // sl.step)),
+                                    _step_or_none(step // sl.step))
                               for sl in slices]
     return [global_intersection] + relative_intersections
 
 
 def slice_hull(*slices, size=None):
     """
-    Calculate tight global slice containing all slices
+    Calculate tight global slice containing all slices. For strided slices, the step of the hull is the largest one
+    whose grid contains all their elements.
 
     :param sl0: slice or tuple
     :param sl1: slice or tuple
@@ -73,9 +144,14 @@ def slice_hull(*slices, size=None):
 
     slices = [_normalize_slice(sl, size) for sl in slices]
     assert all(_is_positive(sl) for sl in slices)
-    if not all(sl.step in (1, None) for sl in slices):
-        raise NotImplementedError
-    global_hull = slice(min(sl.start for sl in slices), max(sl.stop for sl in slices))
+    assert all(sl.step > 0 for sl in slices), 'only positive steps are supported'
+    start = min(sl.start for sl in slices)
+    step = 1
+    if any(sl.step > 1 for sl in slices):  # unit step slices always give a contiguous hull
+        # steps of slices with at most one element do not constrain the grid
+        step = max(1, math.gcd(*(sl.start - start for sl in slices),
+                               *(sl.step for sl in slices if sl.stop - sl.start > sl.step)))
+    global_hull = slice(start, max(sl.stop for sl in slices), _step_or_none(step))
     return global_hull
 
 
@@ -86,7 +162,7 @@ def minimum_global_shape(*slices):
 def slices_to_array(slice_list):
     slice_list = np.array(slice_list)
     shape = slice_list.shape
-    return np.array([[sl.start, sl.stop, sl.step] for sl in slice_list.flatten()]).reshape(*shape, 3) # changed dtype from int32
+    return np.array([_slice_attributes(sl) for sl in slice_list.flatten()]).reshape(*shape, 3) # changed dtype from int32
 
 
 def array_to_slices(array):
@@ -95,23 +171,93 @@ def array_to_slices(array):
     return np.array([slice(*args) for args in array.reshape(-1, 3)]).reshape(*shape)
 
 
+def _starts(slice_list):
+    if isinstance(slice_list, SliceArray):
+        return slice_list.starts
+    return slices_to_array(slice_list)[:, :, 0]
+
+
 def slice_argsort_lexicographical(slice_list):
-    starts = slices_to_array(slice_list)[:, :, 0]
+    starts = _starts(slice_list)
     return np.lexsort(tuple(starts.transpose()[::-1]))
 
 
 def slice_argsort_diagonal(slice_list):
-    diag = slices_to_array(slice_list)[:, :, 0].sum(1)
+    diag = _starts(slice_list).sum(1)
     return np.argsort(diag)
 
 
+def _grid_coordinates(slice_list):
+    """
+    Block starts replaced by their rank along each dimension, i.e. by the position of the blocks in a regular tiling.
+    """
+    starts = _starts(slice_list)
+    coordinates = np.stack([np.unique(starts[:, d], return_inverse=True)[1].reshape(-1)
+                            for d in range(starts.shape[1])]).astype(np.uint64)
+    n_bits = max(1, int(coordinates.max()).bit_length()) if coordinates.size > 0 else 1
+    assert n_bits * len(coordinates) <= 64, 'too many blocks for 64 bit curve indices'
+    return coordinates, n_bits
+
+
+def _interleave_bits(coordinates, n_bits):
+    """
+    Interleave the bits of the coordinates (D x N), most significant bits first and the first dimension leading.
+    """
+    index = np.zeros(coordinates.shape[1], dtype=np.uint64)
+    for bit in reversed(range(n_bits)):
+        for x in coordinates:
+            index = (index << np.uint64(1)) | ((x >> np.uint64(bit)) & np.uint64(1))
+    return index
+
+
+def slice_argsort_morton(slice_list):
+    """
+    Order blocks along the Z-order (Morton) curve through the grid of block starts.
+    """
+    return np.argsort(_interleave_bits(*_grid_coordinates(slice_list)), kind='stable')
+
+
+def slice_argsort_hilbert(slice_list):
+    """
+    Order blocks along the Hilbert curve through the grid of block starts, which keeps the working set of caches small.
+    On grids whose size is a power of two along every dimension, consecutive blocks are always neighbours; on other
+    grids, the curve through the enclosing power of two grid is cut, so occasional jumps occur.
+    """
+    coordinates, n_bits = _grid_coordinates(slice_list)
+    x = coordinates.copy()
+    n = len(x)
+    # Skilling's transform of coordinates to the transposed Hilbert index (J. Skilling, AIP Conf. Proc. 707, 2004)
+    q = 1 << (n_bits - 1)
+    while q > 1:
+        p = np.uint64(q - 1)
+        for i in range(n):
+            high = (x[i] & np.uint64(q)) != 0
+            t = np.where(high, 0, (x[0] ^ x[i]) & p).astype(np.uint64)
+            x[0] ^= np.where(high, p, t).astype(np.uint64)
+            x[i] ^= t
+        q >>= 1
+    for i in range(1, n):  # gray encode
+        x[i] ^= x[i - 1]
+    t = np.zeros_like(x[0])
+    q = 1 << (n_bits - 1)
+    while q > 1:
+        t ^= np.where((x[n - 1] & np.uint64(q)) != 0, np.uint64(q - 1), np.uint64(0))
+        q >>= 1
+    x ^= t
+    return np.argsort(_interleave_bits(x, n_bits), kind='stable')
+
+
+SLICE_ORDERS = {
+    'lex': slice_argsort_lexicographical,
+    'diag': slice_argsort_diagonal,
+    'morton': slice_argsort_morton,
+    'hilbert': slice_argsort_hilbert,
+}
+
+
 def slice_argsort(slice_list, order='lex'):
-    if order == 'lex':
-        return slice_argsort_lexicographical(slice_list)
-    elif order == 'diag':
-        return slice_argsort_diagonal(slice_list)
-    else:
-        assert False, f'order must be in ("lex", "diag"), but got {order}'
+    assert order in SLICE_ORDERS, f'order must be in {tuple(SLICE_ORDERS)}, but got {order}'
+    return SLICE_ORDERS[order](slice_list)
 
 
 def center_slice(big_shape, center_shape):
@@ -121,6 +267,363 @@ def center_slice(big_shape, center_shape):
     return tuple(slice(crop, size-crop) for size, crop in zip(big_shape, to_crop))
 
 
+class SliceArray:
+    """
+    Compact array of N D-dimensional slices (e.g. the blocks of a tiling), stored as integer array of shape (N, D, 3)
+    holding start, stop and step of every slice, with vectorized versions of the slice operations in this module.
+
+    :param data: array of shape (N, D, 3) (or (D, 3) for a single tuple of slices)
+    """
+    def __init__(self, data):
+        data = np.asarray(data, dtype=np.int64)
+        if data.ndim == 2:
+            data = data[None]
+        assert data.ndim == 3 and data.shape[-1] == 3, f'expected shape (N, D, 3), got {data.shape}'
+        self.data = data
+
+    @classmethod
+    def from_slices(cls, slice_list, shape=None):
+        """
+        :param slice_list: list of tuples of slices (or of slices, for D=1)
+        :param shape: shape of the sliced array, needed if slices have open ends
+        """
+        slice_list = [sl if isinstance(sl, Iterable) else (sl,) for sl in slice_list]
+        if len(slice_list) == 0:
+            return cls(np.empty((0, 0 if shape is None else len(shape), 3), dtype=np.int64))
+        data = np.array([list(map(_slice_attributes, sls)) for sls in slice_list], dtype=object)
+        is_none = np.equal(data, None)
+        data[..., 0][is_none[..., 0]] = 0
+        data[..., 2][is_none[..., 2]] = 1
+        if is_none[..., 1].any():
+            assert shape is not None, 'Must give a shape'
+            data[..., 1] = np.where(is_none[..., 1], np.asarray(shape, dtype=object), data[..., 1])
+        result = cls(data.astype(np.int64))
+        return result if shape is None else result.normalize(shape)
+
+    def to_slices(self):
+        return [tuple(itertools.starmap(slice, sl)) for sl in self.data.tolist()]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, item):
+        return SliceArray(self.data[item])
+
+    def __repr__(self):
+        return f'SliceArray({self.to_slices()})'
+
+    @property
+    def ndim(self):
+        return self.data.shape[1]
+
+    @property
+    def starts(self):
+        return self.data[..., 0]
+
+    @property
+    def stops(self):
+        return self.data[..., 1]
+
+    @property
+    def steps(self):
+        return self.data[..., 2]
+
+    @property
+    def shape(self):
+        """
+        Shapes of the sliced arrays, as (N, D) array.
+        """
+        return np.maximum(-(-(self.stops - self.starts) // self.steps), 0)
+
+    def normalize(self, shape):
+        """
+        Resolve negative start and stop values relative to the given shape of the sliced array.
+        """
+        data = self.data.copy()
+        shape = np.asarray(shape, dtype=np.int64)
+        data[..., :2] += np.where(data[..., :2] < 0, shape[:, None], 0)
+        assert (data[..., :2] >= 0).all()
+        return SliceArray(data)
+
+    def shrink(self, margin):
+        """
+        Vectorized shrink_slice. Margin can be scalar or given per dimension.
+        """
+        margin = np.broadcast_to(np.asarray(margin, dtype=np.int64), (self.ndim,))
+        data = self.data.copy()
+        data[..., 0] -= (-margin // self.steps) * self.steps
+        data[..., 1] -= margin
+        return SliceArray(data)
+
+    def overlap(self, other):
+        """
+        Elementwise overlap with other (of the same length, or of length 1), as slice_overlap.
+
+        :return:
+            (global intersections, intersections relative to self, intersections relative to other)
+        """
+        data = np.stack(np.broadcast_arrays(self.data, other.data))
+        start, stop, step = _strided_intersection(data[..., 0], data[..., 1], data[..., 2])
+        return (SliceArray(np.stack([start, stop, step], axis=-1)),) + tuple(
+            SliceArray(np.stack([local_start, np.maximum(local_start, -(-(stop - sl.starts) // sl.steps)),
+                                 step // sl.steps], axis=-1))
+            for sl in (self, other)
+            for local_start in [-(-(start - sl.starts) // sl.steps)])
+
+    def is_empty(self):
+        """
+        Boolean array of length N, true where a slice selects nothing along some dimension.
+        """
+        return (self.shape == 0).any(axis=1)
+
+    def hull(self):
+        """
+        Tight slice containing all slices, as slice_hull.
+
+        :return:
+            SliceArray of length 1
+        """
+        start = self.starts.min(0)
+        # steps of slices with at most one element do not constrain the grid
+        steps = np.where(self.stops - self.starts > self.steps, self.steps, 0)
+        step = np.maximum(np.gcd.reduce(np.concatenate([self.starts - start, steps]), axis=0), 1)
+        step = np.where((self.steps > 1).any(axis=0), step, 1)  # unit step slices always give a contiguous hull
+        return SliceArray(np.stack([start, self.stops.max(0), step], axis=-1))
+
+    def argsort(self, order='lex'):
+        return slice_argsort(self, order)
+
+    def sort(self, order='lex'):
+        return self[self.argsort(order)]
+
+
+class SliceIndex:
+    """
+    Index over N boxes given by D-dimensional slices (with step 1) for fast overlap queries. Boxes are sorted along the
+    dimension that separates them best, and candidates are found by a sweep along it with binary searches, before the
+    other dimensions are checked vectorized. To find all overlapping pairs, the boxes are additionally split into bins
+    along the second best dimension, and only boxes sharing a bin are swept against each other. This takes
+    O(N log N + C) instead of O(N^2) calls of slice_overlap, where C is the number of pairs of boxes that share a bin
+    and overlap along the sweep dimension. For boxes of similar size C is close to the number of overlapping pairs,
+    but e.g. long thin boxes crossing each other can make it much larger.
+
+    :param slices: list of tuples of slices or SliceArray
+    :param shape: shape of the sliced array, needed if slices have open ends
+    """
+    def __init__(self, slices, shape=None):
+        self.boxes = slices if isinstance(slices, SliceArray) else SliceArray.from_slices(slices, shape)
+        assert (self.boxes.steps == 1).all(), 'only step 1 is supported'
+        starts, stops = self.boxes.starts, self.boxes.stops
+        if self.boxes.ndim == 0:  # no boxes
+            starts, stops = np.zeros((0, 1), np.int64), np.zeros((0, 1), np.int64)
+        # sweep along the dimension with the fewest candidate pairs, bin along the second best
+        candidates = [self._candidate_counts(np.sort(starts[:, d]), starts[:, d], stops[:, d]).sum()
+                      for d in range(starts.shape[1])]
+        axes = np.argsort(candidates, kind='stable')
+        self.axis = int(axes[0])
+        self.bin_axis = int(axes[1]) if len(axes) > 1 else None  # see overlapping_pairs
+        valid = ~self.boxes.is_empty()
+        self.order = np.flatnonzero(valid)[np.argsort(starts[valid, self.axis], kind='stable')]
+        self.sorted_starts = starts[self.order, self.axis]
+        self.max_length = (stops - starts)[valid, self.axis].max() if valid.any() else 0
+
+    @staticmethod
+    def _candidate_counts(sorted_starts, starts, stops):
+        return np.searchsorted(sorted_starts, stops, 'left') - np.searchsorted(sorted_starts, starts, 'left')
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _bins(self, boxes):
+        """
+        First and last bin along bin_axis of each box. Bins are as wide as the median box, but there are at most as
+        many bins as boxes.
+        """
+        if self.bin_axis is None:
+            return np.zeros(len(boxes), np.int64), np.zeros(len(boxes), np.int64)
+        starts, stops = boxes[:, self.bin_axis, 0], boxes[:, self.bin_axis, 1]
+        origin = starts.min()
+        width = max(int(np.median(stops - starts)), -(-(stops.max() - origin) // len(boxes)), 1)
+        return (starts - origin) // width, (stops - 1 - origin) // width
+
+    def _overlapping(self, i, j):
+        boxes = self.boxes.data
+        start = np.maximum(boxes[i, :, 0], boxes[j, :, 0])
+        stop = np.minimum(boxes[i, :, 1], boxes[j, :, 1])
+        return (start < stop).all(axis=1)
+
+    def overlapping_pairs(self, max_candidates=2 ** 22):
+        """
+        :param max_candidates: maximum number of candidate pairs checked at once, bounding memory usage
+        :return: (i, j), integer arrays of the indices of all pairs of overlapping boxes, with i < j
+        """
+        if len(self.order) == 0:  # no (non-empty) boxes, possibly without known dimensionality
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        boxes = self.boxes.data[self.order]
+        # entries: the boxes in each of their bins, sorted by bin and then by start along the sweep axis
+        low, high = self._bins(boxes)
+        repeats = high - low + 1
+        entries = np.repeat(np.arange(len(boxes)), repeats)
+        bins = low[entries] + np.arange(len(entries)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        ordering = np.argsort(bins, kind='stable')
+        entries, bins = entries[ordering], bins[ordering]
+        # sweep within the bins, by offsetting the positions along the sweep axis per bin
+        origin = boxes[:, self.axis, 0].min()
+        span = boxes[:, self.axis, 1].max() - origin
+        starts = bins * span + boxes[entries, self.axis, 0] - origin
+        stops = bins * span + boxes[entries, self.axis, 1] - origin
+
+        n = len(entries)
+        ends = np.searchsorted(starts, stops, 'left')
+        counts = np.maximum(ends - np.arange(n) - 1, 0)  # entries in the bin starting after i, but before i ends
+        result_i, result_j = [], []
+        begin = 0
+        while begin < n:
+            # take as many sweep positions as fit into max_candidates (at least one)
+            end = begin + max(1, np.searchsorted(np.cumsum(counts[begin:]), max_candidates, 'right'))
+            first = np.repeat(np.arange(begin, end), counts[begin:end])
+            offsets = np.arange(len(first)) - np.repeat(np.cumsum(counts[begin:end]) - counts[begin:end],
+                                                        counts[begin:end])
+            second = first + 1 + offsets
+            # pairs sharing several bins are only reported in the bin where their overlap along bin_axis begins
+            first_bin = bins[first] == np.maximum(low[entries[first]], low[entries[second]])
+            first, second = first[first_bin], second[first_bin]
+            i, j = self.order[entries[first]], self.order[entries[second]]
+            overlapping = self._overlapping(i, j)
+            i, j = i[overlapping], j[overlapping]
+            result_i.append(np.minimum(i, j))
+            result_j.append(np.maximum(i, j))
+            begin = end
+        if len(result_i) == 0:
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        return np.concatenate(result_i), np.concatenate(result_j)
+
+    def overlaps(self):
+        """
+        All overlapping pairs together with their intersections, as slice_overlap would return them.
+
+        :return: (i, j, global intersections, intersections relative to box i, intersections relative to box j)
+        """
+        i, j = self.overlapping_pairs()
+        return (i, j) + self.boxes[i].overlap(self.boxes[j])
+
+    def query(self, region, shape=None):
+        """
+        Boxes intersecting the region. Takes O(log N) plus the number of boxes overlapping the region along the sweep
+        dimension.
+
+        :param region: tuple of slices
+        :param shape: shape of the sliced array, needed if region has open ends
+        :return: (indices, global intersections, intersections relative to the boxes, intersections relative to region)
+        """
+        region = SliceArray.from_slices([region], shape)
+        if len(self.order) == 0:  # no (non-empty) boxes, possibly without known dimensionality
+            empty = SliceArray(np.empty((0, region.ndim, 3), dtype=np.int64))
+            return np.empty(0, np.int64), empty, empty, empty
+        lower = np.searchsorted(self.sorted_starts, region.starts[0, self.axis] - self.max_length, 'right')
+        upper = np.searchsorted(self.sorted_starts, region.stops[0, self.axis], 'left')
+        candidates = self.order[lower:upper]
+        boxes = self.boxes.data[candidates]
+        start = np.maximum(boxes[:, :, 0], region.starts)
+        stop = np.minimum(boxes[:, :, 1], region.stops)
+        indices = np.sort(candidates[(start < stop).all(axis=1)])
+        return (indices,) + self.boxes[indices].overlap(region)
+
+
+def block_slices(shape, block_shape, halo=0):
+    """
+    Tiling of an array into blocks, with halos.
+
+    :param shape: shape of the array
+    :param block_shape: shape of the blocks (blocks at the upper borders may be smaller)
+    :param halo: int or tuple, margin added to the blocks on both sides, clipped at the array borders
+    :return: SliceArrays of the blocks (cores), of the blocks with halo, and of the cores relative to the blocks with halo
+    """
+    shape, block_shape = np.asarray(shape, np.int64), np.asarray(block_shape, np.int64)
+    halo = np.broadcast_to(np.asarray(halo, np.int64), shape.shape)
+    starts = np.stack(np.meshgrid(*(np.arange(0, s, b) for s, b in zip(shape, block_shape)), indexing='ij'),
+                      axis=-1).reshape(-1, len(shape))
+    stops = np.minimum(starts + block_shape, shape)
+    outer_starts, outer_stops = np.maximum(starts - halo, 0), np.minimum(stops + halo, shape)
+    steps = np.ones_like(starts)
+    return (SliceArray(np.stack([starts, stops, steps], axis=-1)),
+            SliceArray(np.stack([outer_starts, outer_stops, steps], axis=-1)),
+            SliceArray(np.stack([starts - outer_starts, stops - outer_starts, steps], axis=-1)))
+
+
+def _apply_to_block(func, array, out, slices):
+    core, outer, local = slices
+    array, out = open_array(array, 'r'), open_array(out, 'r+')
+    result = func(array[outer])[local]
+    if out is None:  # out can not be written to from this process
+        return core, result
+    out[core] = result
+
+
+def apply_blockwise(func, array, block_shape, halo=0, out=None, n_jobs=0, use_threading=True, order='lex',
+                    max_in_flight=None):
+    """
+    Apply func to an array tile by tile: Each tile is extended by a halo (to provide context), func is applied to it,
+    and the core of the result is written straight into out.
+
+    :param func: function mapping an array to one of the same shape (e.g. a filter or a network prediction)
+    :param array: input array, e.g. np.memmap
+    :param block_shape: shape of the tiles
+    :param halo: int or tuple, margin added to the tiles on both sides (clipped at the array borders)
+    :param out: array of the same shape as array to write to, e.g. np.memmap. Allocated with the dtype of array if None
+    :param n_jobs: number of workers. If 0, tiles are processed in the calling thread
+    :param use_threading: If false, a process pool is used. Workers reopen memmaps by filename instead of receiving
+    copies of the data (other input arrays are copied to a temporary memmap once); if out is not a file backed memmap,
+    the cores are sent back and written by the calling process
+    :param order: order in which tiles are processed, see slice_argsort
+    :param max_in_flight: maximum number of tiles submitted to the pool but not finished, bounding memory usage.
+    Defaults to 2 * n_jobs
+    :return: out
+    """
+    out = np.empty(array.shape, dtype=array.dtype) if out is None else out
+    assert out.shape == array.shape, f'{out.shape} != {array.shape}'
+    cores, outers, locals_ = block_slices(array.shape, block_shape, halo)
+    ordering = slice_argsort(cores, order)
+    tasks = zip(*(sl[ordering].to_slices() for sl in (cores, outers, locals_)))
+
+    if n_jobs == 0:
+        worker = partial(_apply_to_block, func, array, out)
+        for task in tasks:
+            worker(task)
+    else:
+        _apply_in_pool(func, array, out, tasks, n_jobs, use_threading, max_in_flight)
+    # flushing once covers the tiles written by workers through their own maps of the same file, too
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
+def _apply_in_pool(func, array, out, tasks, n_jobs, use_threading, max_in_flight):
+    max_in_flight = 2 * n_jobs if max_in_flight is None else max_in_flight
+    in_flight = deque()
+
+    def finish_oldest():
+        returned = in_flight.popleft().get()
+        if returned is not None:
+            core, result = returned
+            out[core] = result
+
+    with contextlib.ExitStack() as stack:
+        if use_threading:
+            worker = partial(_apply_to_block, func, array, out)
+        else:
+            if memmap_spec(array) is None:  # do not send the whole array along with every tile
+                array = stack.enter_context(temporary_memmap(array))
+            worker = partial(_apply_to_block, func, memmap_spec(array), memmap_spec(out))
+        p = stack.enter_context((ThreadPool if use_threading else Pool)(n_jobs))
+        for task in tasks:
+            if len(in_flight) >= max_in_flight:
+                finish_oldest()
+            in_flight.append(p.apply_async(worker, (task,)))
+        while in_flight:
+            finish_oldest()
+
+
 if __name__ == '__main__':
     a = np.array([[1, 2, 3], [1, 2, 3], [3, 4, 5], [3, 6, 5]])
     print(a)
@@ -0,0 +1,259 @@
+import os
+import time
+import uuid
+import pickle
+import socket
+import sqlite3
+import argparse
+import threading
+import traceback
+
+
+PENDING, RUNNING, DONE, FAILED = range(4)
+
+
+class WorkQueue:
+    """
+    Queue of function evaluations stored in an SQLite database, e.g. on a filesystem shared between several nodes.
+    Independent worker processes (started with run_worker or 'python -m fancy.work_queue PATH') pull tasks from it.
+    A task is leased to a worker for lease_time seconds, and the lease is renewed while the task is running, so tasks
+    of workers that died are handed out again once their lease expired.
+
+    Pass it as work_queue to execute_parallel or grid_evaluate to distribute the evaluations over all workers. The
+    evaluated function has to be importable by the workers (i.e. not be defined in __main__ or interactively).
+
+    :param path: str
+        Path of the database file. Created if it does not exist.
+    :param lease_time: float
+        Seconds after which a task whose worker stopped renewing its lease is handed out again.
+    :param max_attempts: int
+        Number of times a task is handed out before it is marked as failed.
+    """
+    def __init__(self, path, lease_time=60, max_attempts=3):
+        self.path = path
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        self._connection = None
+        with self._transaction() as c:
+            c.execute('''CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                batch TEXT,
+                position INTEGER,
+                payload BLOB,
+                status INTEGER DEFAULT 0,
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER DEFAULT 0,
+                result BLOB,
+                error TEXT)''')
+            c.execute('CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id)')
+            c.execute('CREATE INDEX IF NOT EXISTS tasks_batch ON tasks (batch, position)')
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # connections and locks cannot be shared between processes, they are recreated on first use
+        state['_connection'] = None
+        state.pop('_lock', None)
+        state.pop('_connection_pid', None)
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None or self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=600, isolation_level=None,
+                                               check_same_thread=False)
+            self._connection_pid = os.getpid()
+            self._lock = threading.Lock()
+        return self._connection
+
+    def _transaction(self):
+        return _Transaction(self)
+
+    def submit(self, func, args_list=None, kwargs_list=None):
+        """
+        Add evaluations of func to the queue.
+
+        :return:
+            str, id of the batch of submitted tasks
+        """
+        assert args_list is not None or kwargs_list is not None, 'either args_list or kwargs_list must not be None'
+        args_list = [()] * len(kwargs_list) if args_list is None else args_list
+        kwargs_list = [{}] * len(args_list) if kwargs_list is None else kwargs_list
+        batch = uuid.uuid4().hex
+        with self._transaction() as c:
+            c.executemany('INSERT INTO tasks (batch, position, payload) VALUES (?, ?, ?)',
+                          ((batch, i, pickle.dumps((func, tuple(args), kwargs), protocol=4))
+                           for i, (args, kwargs) in enumerate(zip(args_list, kwargs_list))))
+        return batch
+
+    def claim(self, worker, batch=None):
+        """
+        Lease the next pending (or abandoned) task to worker.
+
+        :return:
+            (task id, payload) or None if there is nothing to do
+        """
+        now = time.time()
+        with self._transaction() as c:
+            # give up on tasks whose workers repeatedly died
+            c.execute('UPDATE tasks SET status = ?, error = ? WHERE status = ? AND lease_until < ? AND attempts >= ?',
+                      (FAILED, 'lease expired too often', RUNNING, now, self.max_attempts))
+            query = 'SELECT id, payload FROM tasks WHERE (status = ? OR (status = ? AND lease_until < ?))'
+            parameters = (PENDING, RUNNING, now)
+            if batch is not None:
+                query += ' AND batch = ?'
+                parameters += (batch,)
+            row = c.execute(query + ' ORDER BY id LIMIT 1', parameters).fetchone()
+            if row is None:
+                return None
+            c.execute('UPDATE tasks SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?',
+                      (RUNNING, worker, now + self.lease_time, row[0]))
+        return row
+
+    def renew(self, task_id, worker):
+        with self._transaction() as c:
+            c.execute('UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND status = ?',
+                      (time.time() + self.lease_time, task_id, worker, RUNNING))
+
+    def complete(self, task_id, result):
+        with self._transaction() as c:
+            c.execute('UPDATE tasks SET status = ?, result = ? WHERE id = ? AND status != ?',
+                      (DONE, pickle.dumps(result, protocol=4), task_id, DONE))
+
+    def fail(self, task_id, error):
+        with self._transaction() as c:
+            c.execute('UPDATE tasks SET status = ?, error = ? WHERE id = ? AND status != ?',
+                      (FAILED, error, task_id, DONE))
+
+    def process(self, task_id, payload, worker):
+        """
+        Evaluate a claimed task, renewing its lease while running, and store the result or the error.
+        """
+        stop = threading.Event()
+
+        def renew_lease():
+            while not stop.wait(self.lease_time / 3):
+                self.renew(task_id, worker)
+
+        renewer = threading.Thread(target=renew_lease, daemon=True)
+        renewer.start()
+        try:
+            func, args, kwargs = pickle.loads(payload)
+            result = func(*args, **kwargs)
+        except Exception:
+            self.fail(task_id, traceback.format_exc())
+        else:
+            self.complete(task_id, result)
+        finally:
+            stop.set()
+            renewer.join()
+
+    def progress(self, batch=None):
+        """
+        :return:
+            dict with the number of pending, running, done and failed tasks
+        """
+        query = 'SELECT status, COUNT(*) FROM tasks' + ('' if batch is None else ' WHERE batch = ?') + ' GROUP BY status'
+        with self._transaction() as c:
+            counts = dict(c.execute(query, () if batch is None else (batch,)).fetchall())
+        return {name: counts.get(status, 0)
+                for status, name in enumerate(['pending', 'running', 'done', 'failed'])}
+
+    def results(self, batch):
+        """
+        Results of a finished batch, in the order of submission.
+        """
+        with self._transaction() as c:
+            rows = c.execute('SELECT status, result, error FROM tasks WHERE batch = ? ORDER BY position',
+                             (batch,)).fetchall()
+        for status, _, error in rows:
+            if status == FAILED:
+                raise RuntimeError(f'evaluation failed on worker:\n{error}')
+            assert status == DONE, 'batch is not finished yet'
+        return [pickle.loads(result) for _, result, _ in rows]
+
+    def remove(self, batch):
+        with self._transaction() as c:
+            c.execute('DELETE FROM tasks WHERE batch = ?', (batch,))
+
+    def map(self, func, args_list=None, kwargs_list=None, participate=True, poll_interval=1.):
+        """
+        Evaluate func for all given arguments on the workers of the queue and return the results in order.
+
+        :param participate: bool
+            If true, the calling process also works on the submitted tasks.
+        :param poll_interval: float
+            Seconds between checks whether the workers are done.
+        """
+        batch = self.submit(func, args_list, kwargs_list)
+        worker = _worker_id()
+        try:
+            while True:
+                task = self.claim(worker, batch) if participate else None
+                if task is not None:
+                    self.process(*task, worker)
+                    continue
+                progress = self.progress(batch)
+                if progress['failed'] > 0 or progress['pending'] + progress['running'] == 0:
+                    return self.results(batch)
+                time.sleep(poll_interval)
+        finally:
+            self.remove(batch)
+
+
+class _Transaction:
+    """
+    Context manager running an immediate (i.e. write locking) transaction on the connection of a WorkQueue.
+    """
+    def __init__(self, queue):
+        self.queue = queue
+
+    def __enter__(self):
+        connection = self.queue.connection
+        self.queue._lock.acquire()
+        connection.execute('BEGIN IMMEDIATE')
+        return connection
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            self.queue.connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        finally:
+            self.queue._lock.release()
+
+
+def _worker_id():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def run_worker(path, idle_timeout=None, poll_interval=1., lease_time=60):
+    """
+    Work on the tasks of the queue at path until no task was available for idle_timeout seconds (forever if None).
+
+    :return:
+        int, number of processed tasks
+    """
+    queue = WorkQueue(path, lease_time=lease_time)
+    worker = _worker_id()
+    n_processed = 0
+    idle_since = time.time()
+    while True:
+        task = queue.claim(worker)
+        if task is not None:
+            queue.process(*task, worker)
+            n_processed += 1
+            idle_since = time.time()
+        elif idle_timeout is not None and time.time() - idle_since >= idle_timeout:
+            return n_processed
+        else:
+            time.sleep(poll_interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Work on the tasks of a fancy.work_queue.WorkQueue.')
+    parser.add_argument('path', help='path of the queue database')
+    parser.add_argument('--idle-timeout', type=float, default=None,
+                        help='exit after no task was available for this many seconds')
+    parser.add_argument('--poll-interval', type=float, default=1.)
+    parser.add_argument('--lease-time', type=float, default=60)
+    arguments = parser.parse_args()
+    run_worker(arguments.path, arguments.idle_timeout, arguments.poll_interval, arguments.lease_time)